@@ -0,0 +1,82 @@
+"""
+Local alignment (Smith-Waterman) of claraprints, to find a short excerpt (like a 30s claraprint) inside a longer
+reference (like a 120s claraprint).
+
+distance_levenshtein compares whole fingerprints, so the letters of the reference that are not in the excerpt count
+as differences. Local alignment only scores the best matching part of the reference.
+
+The dynamic programming matrix is computed one query letter (one row) at a time, for all the letters of all the
+references at once, with numpy:
+- the score of a letter against every letter of the references is precomputed once per distinct letter of the query
+  (query profile). A claraprint uses at most 14 letters;
+- the dependency on the cell on the left, H[j] = max(T[j], H[j - 1] - gap), is resolved for the whole row with a
+  cumulative maximum: H[j] = max over k <= j of (T[k] + gap * k) - gap * j.
+
+Scores: match adds match, mismatch adds mismatch (negative), each inserted or deleted letter removes gap. The highest
+score is the best match, like the distances of utils.py.
+"""
+
+import numpy as np
+
+
+def _to_codes(text):
+    return np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+
+
+def local_alignment_many(query, references, match=2, mismatch=-1, gap=1, normalize=False):
+    """
+    Local alignment score of one query against many references, all computed at once.
+
+    :param query: The fingerprint to look for, like a 30s claraprint
+    :param references: The fingerprints to look into, like 120s claraprints
+    :param match: Score of two equal letters
+    :param mismatch: Score of two different letters. Must be negative
+    :param gap: Penalty of a letter inserted or deleted. Must be positive
+    :param normalize: If True, divide each score by the best possible score (match * the length of the shortest of
+      the query and the reference), so scores are between 0 and 1
+    :return: A numpy array of scores, in the same order as references
+    """
+    num_references = len(references)
+    if num_references == 0:
+        return np.empty(0, dtype=np.float64 if normalize else np.int32)
+
+    # References padded to the same length. Padding is \0, never in a claraprint, so it always mismatches and cannot
+    # increase the best score
+    lengths = np.array([len(reference) for reference in references])
+    max_length = lengths.max()
+    padded = np.zeros((num_references, max_length), dtype=np.uint8)
+    for i, reference in enumerate(references):
+        padded[i, :len(reference)] = _to_codes(reference)
+
+    # Query profile: for each distinct letter of the query, its score against all letters of the references
+    query_codes = _to_codes(query)
+    profile = {code: np.where(padded == code, match, mismatch).astype(np.int32) for code in np.unique(query_codes)}
+
+    # Column 0 is the empty prefix of the references
+    offsets = gap * np.arange(max_length + 1, dtype=np.int32)
+    previous = np.zeros((num_references, max_length + 1), dtype=np.int32)
+    best = np.zeros(num_references, dtype=np.int32)
+    row = np.zeros((num_references, max_length + 1), dtype=np.int32)
+    for code in query_codes:
+        # Best of: restart (0), diagonal (match or mismatch), cell above (gap)
+        row[:, 1:] = np.maximum(np.maximum(previous[:, :-1] + profile[code], previous[:, 1:] - gap), 0)
+        # Cell on the left (gap), for the whole row at once
+        current = np.maximum.accumulate(row + offsets, axis=1) - offsets
+        np.maximum(best, current.max(axis=1), out=best)
+        previous = current
+
+    if normalize:
+        best_possible = match * np.minimum(len(query), lengths)
+        return np.where(best_possible > 0, best / np.maximum(best_possible, 1), 0.)
+
+    return best
+
+
+def local_alignment_score(query, reference, match=2, mismatch=-1, gap=1, normalize=False):
+    """
+    Local alignment score of a query against one reference. See local_alignment_many for the parameters.
+    Can be used as a distance to re-rank candidates, like lsh.LSHIndex.search(..., distance=local_alignment_score)
+
+    :return: The score. Highest is the best match
+    """
+    return local_alignment_many(query, [reference], match, mismatch, gap, normalize)[0]
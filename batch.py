@@ -0,0 +1,172 @@
+"""
+Compute claraprints for a whole catalogue of audio files, using a pool of processes.
+
+The audio files are given either as a directory (searched recursively) or as a manifest, a text file with one audio
+path per line. Results are written as JSON lines, one line per audio file:
+
+    {"audio_path": "/data/audio/myfile.mp3", "algos": ["chords_chordino", ...], "offset": 0.0, "duration": null,
+     "claraprints": {"chords_chordino": "hjkhab...", ...}}
+
+or, if the computation failed for this file:
+
+    {"audio_path": "/data/audio/myfile.mp3", "algos": [...], "offset": 0.0, "duration": null, "error": "..."}
+
+Each line is flushed as soon as the file is processed. When the output file already exists, the audio files already
+fingerprinted with the same algos, offset and duration are skipped, so a crashed run can be resumed by running the
+same command again. Failed files are retried, and so are files fingerprinted with other algos or another window.
+
+Usage:
+
+    python -m batch /data/audio --output claraprints.jsonl --workers 8
+    python -m batch manifest.txt --output claraprints.jsonl --algos chords_chordino melody_melodia
+    python -m batch /data/audio --output claraprints.jsonl --cache-dir /data/claraprint_cache
+    python -m batch /data/audio --output claraprints_120s.jsonl --duration 120
+"""
+
+import argparse
+import json
+import os
+from multiprocessing import Pool, cpu_count
+
+from cache import ExtractionCache
+from fingerprint import all_algos, claraprints
+
+# Extensions of the files considered as audio when a directory is given
+audio_extensions = (".mp3", ".wav", ".flac", ".ogg", ".m4a", ".aiff", ".aif")
+
+
+def list_audio_files(source):
+    """
+    List the audio files to fingerprint.
+
+    :param source: Either a directory, searched recursively for files with an extension in audio_extensions, or a
+      manifest file containing one audio path per line. Empty lines and lines starting with # are ignored.
+    :return: A sorted list of audio paths
+    """
+    if os.path.isdir(source):
+        audio_paths = []
+        for root, _dirs, files in os.walk(source):
+            for file in files:
+                if file.lower().endswith(audio_extensions):
+                    audio_paths.append(os.path.join(root, file))
+        audio_paths.sort()
+        return audio_paths
+
+    if not os.path.isfile(source):
+        raise OSError(f"Directory or manifest {source} not found")
+
+    with open(source, "r") as manifest:
+        lines = [line.strip() for line in manifest]
+
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def read_done(output_path, algos=all_algos, offset=0., duration=None):
+    """
+    Read the audio paths already fingerprinted in a previous run, from the given JSON lines output.
+    A line truncated by a crash is ignored.
+
+    :param output_path: The JSON lines output of a previous run
+    :param algos: Only the lines with claraprints of these algos count as done
+    :param offset: Only the lines of a window starting at offset count as done
+    :param duration: Only the lines of a window of this duration count as done
+    :return: A set of audio paths successfully fingerprinted with these algos and window
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, "r") as output:
+        for line in output:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if "claraprints" not in result:
+                continue
+            # Lines written before the algos and the window were stored: the algos are the keys of the claraprints,
+            # and the whole file was fingerprinted
+            result_algos = result.get("algos", list(result["claraprints"]))
+            if sorted(result_algos) == sorted(algos) and result.get("offset", 0.) == offset \
+                    and result.get("duration") == duration:
+                done.add(result["audio_path"])
+
+    return done
+
+
+def fingerprint_one(task):
+    """
+    Compute the claraprints of one audio file. Run in a worker process. Never raises, the error is returned instead,
+    so one broken file does not stop the batch.
+
+    :param task: A tuple (audio_path, algos, cache, offset, duration)
+    :return: A dict to be written as a JSON line
+    """
+    audio_path, algos, cache, offset, duration = task
+    result = {"audio_path": audio_path, "algos": list(algos), "offset": offset, "duration": duration}
+    try:
+        result["claraprints"] = claraprints(audio_path, algos, cache=cache, offset=offset, duration=duration)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    return result
+
+
+def run_batch(source, output_path, algos=all_algos, workers=None, chunksize=4, cache=None, offset=0., duration=None):
+    """
+    Compute the claraprints of all audio files of source, and append them as JSON lines to output_path.
+    Audio files already in output_path, fingerprinted with the same algos, offset and duration, are skipped.
+
+    :param source: A directory or a manifest, see list_audio_files
+    :param output_path: The JSON lines file to write the results to
+    :param algos: The algos to compute for each audio file
+    :param workers: Number of worker processes. Default is the number of CPUs
+    :param chunksize: Number of audio files sent at once to a worker. Bigger chunks reduce the communication
+      overhead, smaller ones balance the work better when the durations of the files vary a lot.
+    :param cache: An optional cache.ExtractionCache shared by all workers, see fingerprint.extract_all_pitches
+    :param offset: Start of the window of each audio file to fingerprint, in seconds
+    :param duration: Duration of the window of each audio file to fingerprint, in seconds. Default is the whole file
+    :return: A tuple (number of files fingerprinted, number of files in error)
+    """
+    done = read_done(output_path, algos, offset, duration)
+    tasks = [(audio_path, algos, cache, offset, duration)
+             for audio_path in list_audio_files(source) if audio_path not in done]
+
+    num_ok = 0
+    num_errors = 0
+    with open(output_path, "a") as output, Pool(processes=workers or cpu_count()) as pool:
+        for result in pool.imap_unordered(fingerprint_one, tasks, chunksize=chunksize):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+            if "error" in result:
+                num_errors += 1
+            else:
+                num_ok += 1
+
+    return num_ok, num_errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute claraprints of a catalogue of audio files")
+    parser.add_argument("source", help="A directory of audio files, or a manifest with one audio path per line")
+    parser.add_argument("--output", required=True, help="JSON lines file to write the claraprints to")
+    parser.add_argument("--algos", nargs="+", default=all_algos, choices=all_algos, help="Algos to compute")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (default: number of CPUs)")
+    parser.add_argument("--chunksize", type=int, default=4, help="Number of files sent at once to a process")
+    parser.add_argument("--cache-dir", default=None, help="Directory of the extractors cache (default: no cache)")
+    parser.add_argument("--cache-size", type=int, default=10 * 1024 ** 3, help="Maximum size of the cache in bytes")
+    parser.add_argument("--offset", type=float, default=0., help="Start of the window to fingerprint, in seconds")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Duration of the window to fingerprint, in seconds, like 30 or 120 (default: whole file)")
+    args = parser.parse_args()
+
+    cache = ExtractionCache(args.cache_dir, max_size=args.cache_size) if args.cache_dir else None
+    num_ok, num_errors = run_batch(args.source, args.output, algos=args.algos, workers=args.workers,
+                                   chunksize=args.chunksize, cache=cache, offset=args.offset,
+                                   duration=args.duration)
+    print(f"fingerprinted={num_ok},errors={num_errors}")
+
+
+if __name__ == "__main__":
+    main()
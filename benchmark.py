@@ -0,0 +1,276 @@
+"""
+Time each stage of the claraprint pipeline separately, and write the results as JSON.
+
+Audio stages, run on the given audio files, or on a synthetic recording (a chord progression) if none is given:
+- decode: extract_information.load_audio
+- extract_<algo>: the extractor of each algo, on the decoded buffer
+- clean_<algo>: clean_chords or clean_melody
+- fgpt_<algo>: conversion of the cleaned chords or melody to a claraprint
+
+Dataset stages, run on the claraprints of the dataset (see utils_experiments.get_all_fingerprints). If the dataset of
+an algo is not available, it is reported in errors as dataset_<algo>:
+- shingle_<algo>: utils.fingerprints_to_words, per claraprint
+- shingle_hashes_<algo>: fingerprint.encode_fingerprint then utils.shingle_hashes, per claraprint
+- ingest_<algo> and query_<algo>: ingestion and query times of one round of es_multiple_fp_generated, per document,
+  on the in-process index of experiments/memory_helper.py (default) or on Elasticsearch
+
+All times are in seconds. The output looks like:
+
+    {"meta": {...}, "stages": {"decode": {"mean": 0.41, "min": 0.40, "max": 0.43, "runs": [...]}, ...}, "errors": {}}
+
+A stage failing (like an extractor whose dependency is not installed) is reported in errors, and the other stages still
+run. With --baseline, the mean of each stage is compared to a previous output, to catch regressions.
+
+Usage:
+
+    python -m benchmark --output benchmark.json
+    python -m benchmark --audio /data/audio/a.mp3 /data/audio/b.mp3 --algos chords_chordino --repeat 5
+    python -m benchmark --output benchmark.json --baseline previous_benchmark.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from fingerprint import all_algos, clean_pitches, encode_fingerprint, extract_pitches, fgpt, get_letters_set_from_algo
+from utils import fingerprints_to_words, shingle_hashes
+
+# Chords of the synthetic recording, as frequencies of their notes in Hz: C, Am, F, G
+synthetic_chords = [
+    [261.63, 329.63, 392.00],
+    [220.00, 261.63, 329.63],
+    [174.61, 220.00, 261.63],
+    [196.00, 246.94, 293.66]
+]
+
+
+def synthetic_audio(audio_path, duration=30., sr=44100, chord_duration=2.):
+    """
+    Write a synthetic recording: the chords of synthetic_chords, in loop, with the highest note an octave above as
+    the melody. Written with the wave module, so no audio library is needed.
+
+    :param audio_path: The path of the wav file to write
+    :param duration: Duration in seconds
+    :param sr: Sample rate
+    :param chord_duration: Duration of each chord in seconds
+    """
+    t = np.arange(int(chord_duration * sr)) / sr
+    # Short fade in and out, so that chord changes do not click
+    envelope = np.minimum(1., np.minimum(t, chord_duration - t) / .05)
+
+    blocks = []
+    for num_chord in range(int(np.ceil(duration / chord_duration))):
+        notes = synthetic_chords[num_chord % len(synthetic_chords)]
+        block = sum(np.sin(2 * np.pi * f * t) for f in notes) + 1.5 * np.sin(2 * np.pi * 2 * notes[-1] * t)
+        blocks.append(envelope * block / (len(notes) + 1.5))
+    y = np.concatenate(blocks)[:int(duration * sr)]
+
+    with wave.open(audio_path, "wb") as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(sr)
+        audio.writeframes((y * .8 * 32767).astype("<i2").tobytes())
+
+
+def timed(func, *args, **kwargs):
+    """
+    :return: A tuple (result of func, duration of the call in seconds)
+    """
+    t1 = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - t1
+
+
+def summarize(runs):
+    """
+    :param runs: The durations of all runs of a stage
+    :return: A dict with the mean, min and max duration, and all durations
+    """
+    return {"mean": float(np.mean(runs)), "min": float(np.min(runs)), "max": float(np.max(runs)), "runs": runs}
+
+
+def benchmark_audio(audio_paths, algos=all_algos, repeat=3):
+    """
+    Time the audio stages (decode, extract, clean, fgpt) on each audio file, repeat times.
+
+    :param audio_paths: The audio files
+    :param algos: The algos to time. See fingerprint.all_algos
+    :param repeat: Number of times each stage is run on each file
+    :return: A tuple (dict stage -> list of durations, dict stage -> error message)
+    """
+    try:
+        from extract_information import load_audio
+    except ImportError as e:
+        return {}, {"decode": repr(e)}
+
+    runs = {}
+    errors = {}
+    for audio_path in audio_paths:
+        for _ in range(repeat):
+            try:
+                (y, sr), duration = timed(load_audio, audio_path)
+            except Exception as e:
+                errors["decode"] = f"{audio_path}: {e!r}"
+                break
+            runs.setdefault("decode", []).append(duration)
+
+            for algo in algos:
+                if "extract_" + algo in errors:
+                    continue
+                try:
+                    pitches, duration = timed(extract_pitches, algo, y=y, sr=sr)
+                except Exception as e:
+                    errors["extract_" + algo] = repr(e)
+                    continue
+                runs.setdefault("extract_" + algo, []).append(duration)
+
+                (chords_clean, letters_set), duration = timed(clean_pitches, pitches, algo)
+                runs.setdefault("clean_" + algo, []).append(duration)
+
+                _claraprint, duration = timed(fgpt, chords_clean, letters_set)
+                runs.setdefault("fgpt_" + algo, []).append(duration)
+
+    return runs, errors
+
+
+def benchmark_dataset(algos=all_algos, duration=120, range_words=range(2, 8), index="memory"):
+    """
+    Time the dataset stages (shingle, ingest, query) on the claraprints of the dataset.
+
+    :param algos: The algos to time. See fingerprint.all_algos
+    :param duration: The claraprints of the dataset to use, 30 or 120
+    :param range_words: The word lengths used to shingle the claraprints
+    :param index: "memory" for the in-process index of experiments/memory_helper.py, "es" for Elasticsearch
+    :return: A tuple (dict stage -> list of durations, dict stage -> error message)
+    """
+    from utils_experiments import get_all_fingerprints
+
+    runs = {}
+    errors = {}
+    try:
+        from experiments.es_multiple_fp_generated.es_multiple_fp_generated import Config, run_round
+    except Exception as e:
+        # The ingest and query stages can't run, the shingle stages still do
+        errors["index"] = repr(e)
+        run_round = None
+
+    if index == "memory":
+        from experiments.memory_helper import create_index_memory, memory_refresh, memory_search, \
+            store_one_fingerprint_memory
+        index_funcs = {"search_func": memory_search, "ingest_func": store_one_fingerprint_memory,
+                       "createindex_func": create_index_memory, "refresh_func": memory_refresh}
+    else:
+        index_funcs = {}  # Defaults of Config are the Elasticsearch functions
+
+    for algo in algos:
+        try:
+            all_fingerprints = get_all_fingerprints(duration, algo)
+        except Exception as e:
+            errors["dataset_" + algo] = repr(e)
+            continue
+
+        shingle_runs = []
+        for fingerprint in all_fingerprints.values():
+            _words, shingle_duration = timed(fingerprints_to_words, fingerprint, range_words)
+            shingle_runs.append(shingle_duration)
+        runs["shingle_" + algo] = shingle_runs
+
+        letters_set = get_letters_set_from_algo(algo)
+        hashes_runs = []
+        for fingerprint in all_fingerprints.values():
+            _hashes, hashes_duration = timed(lambda: shingle_hashes(encode_fingerprint(fingerprint, letters_set),
+                                                                    range_words))
+            hashes_runs.append(hashes_duration)
+        runs["shingle_hashes_" + algo] = hashes_runs
+
+        if run_round is None:
+            continue
+        config = Config(algo=algo, duration=duration, letters_to_use=letters_set,
+                        range_words=[range_words], num_sources=[1], rounds=1, **index_funcs)
+        try:
+            _job_id, _scores, time_insert, time_query, _latencies = run_round((0, config, 1, range_words))
+        except Exception as e:
+            # Like Elasticsearch not reachable with --index es
+            errors["index_" + algo] = repr(e)
+            continue
+        runs["ingest_" + algo] = [time_insert]
+        runs["query_" + algo] = [time_query]
+
+    return runs, errors
+
+
+def compare(stages, baseline_stages):
+    """
+    :param stages: The stages of a benchmark output
+    :param baseline_stages: The stages of a previous benchmark output
+    :return: A dict stage -> mean of stages / mean of baseline, for the stages in both
+    """
+    return {stage: stages[stage]["mean"] / baseline_stages[stage]["mean"]
+            for stage in stages if stage in baseline_stages and baseline_stages[stage]["mean"] > 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each stage of the claraprint pipeline")
+    parser.add_argument("--audio", nargs="+", default=None, help="Audio files (default: a synthetic recording)")
+    parser.add_argument("--algos", nargs="+", default=all_algos, choices=all_algos, help="Algos to time")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each audio stage on each file")
+    parser.add_argument("--duration", type=int, default=120, help="Claraprints of the dataset to use, 30 or 120")
+    parser.add_argument("--index", default="memory", choices=["memory", "es"],
+                        help="Index used to time ingestion and query (default: in-process index)")
+    parser.add_argument("--no-dataset", action="store_true", help="Only time the audio stages")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="Previous JSON output to compare the results to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_paths = args.audio
+        if not audio_paths:
+            audio_paths = [os.path.join(tmp_dir, "synthetic.wav")]
+            synthetic_audio(audio_paths[0])
+        runs, errors = benchmark_audio(audio_paths, args.algos, args.repeat)
+
+    if not args.no_dataset:
+        dataset_runs, dataset_errors = benchmark_dataset(args.algos, args.duration, index=args.index)
+        runs.update(dataset_runs)
+        errors.update(dataset_errors)
+
+    result = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "numpy": np.__version__,
+            "audio": args.audio or "synthetic",
+            "algos": args.algos,
+            "repeat": args.repeat,
+            "duration": args.duration,
+            "index": args.index
+        },
+        "stages": {stage: summarize(stage_runs) for stage, stage_runs in runs.items()},
+        "errors": errors
+    }
+
+    if args.baseline:
+        with open(args.baseline, "r") as baseline:
+            result["ratios"] = compare(result["stages"], json.load(baseline)["stages"])
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+        for stage, summary in result["stages"].items():
+            ratio = result.get("ratios", {}).get(stage)
+            print(f"{stage}={summary['mean']:.6f}s" + (f" (x{ratio:.2f})" if ratio is not None else ""))
+        for stage, error in errors.items():
+            print(f"{stage}: {error}")
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
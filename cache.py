@@ -0,0 +1,187 @@
+"""
+Persistent on-disk cache for the raw output of the extractors (chords or melody in JAMS format).
+
+Running chordino, crema or melodia is the expensive part of a claraprint. Cleaning (clean_chords, clean_melody) and
+fgpt are cheap. With this cache, the raw extractor output of an audio file is computed once, and claraprints can be
+recomputed with other thresholds or letter sets without running the extractors again.
+
+An entry is keyed by the hash of the audio content, the extractor name, the extractor parameters, the extractor
+library version and the version of the output format of the extractor (see extract_information.extractor_version).
+Changing any of them misses the cache instead of returning stale data.
+
+Entries are JSON files, written atomically (temporary file + rename), so several processes can share the same cache
+directory. The cache is bounded in size: when it grows over max_size, the least recently used entries are deleted.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+
+def hash_audio_file(audio_path, block_size=1 << 20):
+    """
+    Hash the content of an audio file. Renaming or moving the file keeps the same hash.
+
+    :param audio_path: The full audio path
+    :param block_size: Size of the blocks read from the file, in bytes
+    :return: The sha256 hex digest of the file content
+    """
+    sha = hashlib.sha256()
+    with open(audio_path, "rb") as audio:
+        for block in iter(lambda: audio.read(block_size), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def _to_json(obj):
+    """
+    Serialize objects the json module does not know, as returned by the extractors. JAMS objects (crema) expose their
+    JSON form in __json__, numpy arrays and scalars have tolist.
+    """
+    if hasattr(obj, "__json__"):
+        return obj.__json__
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class ExtractionCache(object):
+    """
+    Size-bounded LRU cache of extractor outputs, stored in a directory.
+
+    Usage:
+
+        cache = ExtractionCache("/data/claraprint_cache", max_size=10 * 1024 ** 3)
+        claraprints(audio_path, cache=cache)
+    """
+
+    def __init__(self, directory, max_size=10 * 1024 ** 3):
+        """
+        :param directory: Directory of the cache. Created if it does not exist
+        :param max_size: Maximum size of the cache in bytes. When it is reached, the least recently used entries are
+          deleted until the cache is back to 90% of this size.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None  # Estimated size of the cache, computed on first write
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(audio_hash, algo, parameters, version):
+        """
+        Build the key of a cache entry.
+
+        :param audio_hash: Hash of the audio content, see hash_audio_file
+        :param algo: The extractor, like "chords_chordino"
+        :param parameters: Dict of the extractor parameters, like {"voicing": 0.6, ...}
+        :param version: Version of the extractor library
+        :return: The key, as an hex string
+        """
+        description = json.dumps([audio_hash, algo, parameters, version], sort_keys=True)
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        """
+        :param key: The key of the entry, see key
+        :return: The cached extractor output, or None if not in cache
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r") as entry:
+                data = json.load(entry)
+        except (OSError, ValueError):
+            # Missing, evicted by another process, or unreadable
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, key, data):
+        """
+        Store an extractor output. The entry is first written to a temporary file, then renamed, so a concurrent
+        reader never sees a partial entry.
+
+        :param key: The key of the entry, see key
+        :param data: The extractor output, in JAMS format
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Size of the entry replaced, if any, so that it is not counted twice
+        try:
+            replaced_size = os.path.getsize(path)
+        except OSError:
+            replaced_size = 0
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as entry:
+                json.dump(data, entry, default=_to_json)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += os.path.getsize(path) - replaced_size
+
+        if self._size > self.max_size:
+            self.evict()
+
+    def _entries(self):
+        """
+        :return: A list of (last use time, size, path) for all entries of the cache
+        """
+        entries = []
+        for root, _dirs, files in os.walk(self.directory):
+            for file in files:
+                if not file.endswith(".json"):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        return entries
+
+    def size(self):
+        """
+        :return: The size of all entries of the cache, in bytes
+        """
+        return sum(size for _mtime, size, _path in self._entries())
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache is back to 90% of max_size.
+        """
+        entries = self._entries()
+        entries.sort()
+
+        size = sum(size for _mtime, size, _path in entries)
+        target = self.max_size * .9
+        for _mtime, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already deleted by another process
+                pass
+            size -= entry_size
+
+        self._size = size
@@ -0,0 +1,350 @@
+"""
+Columnar, memory-mapped store of the claraprints of a dataset (like dataset/dataset_rdb_100.jams.json).
+
+Loading the JSON dataset parses every claraprint of every recording, each time an experiment needs it. The store is
+built once from the JSON dataset, and then opened in constant time: nothing is read from the disk until a claraprint
+is accessed.
+
+A store is a directory containing:
+- claraprints.bin: all claraprints, utf-8 encoded and concatenated, recording by recording;
+- offsets.npy: the start of each claraprint in claraprints.bin. The claraprint of recording row in column col is
+  claraprints.bin[offsets[row * num_columns + col]:offsets[row * num_columns + col + 1]];
+- rdb_ids.npy, movements.npy, ytb_ids.npy and urls.npy: the metadata of each recording, one value per row;
+- meta.json: the name of the columns (like "120s_chords_chordino") and the number of recordings. Written last, so an
+  interrupted conversion is not mistaken for a store.
+
+The JSON dataset can also be read without loading it whole, directly from the gzipped file: iter_pieces parses the
+array of pieces one piece at a time, and iter_claraprints flattens it into (piece id, ytb id, algo, claraprint).
+
+Usage:
+
+    python -m dataset_store dataset/dataset_rdb_100.jams.json.gz dataset/dataset_rdb_100.store
+
+    for piece_id, ytb_id, algo, claraprint in iter_claraprints("dataset/dataset_rdb_100.jams.json.gz"):
+        ...
+
+    store = DatasetStore("dataset/dataset_rdb_100.store")
+    store.claraprint(0, "120s_chords_chordino")
+"""
+
+import argparse
+from array import array
+from collections.abc import Mapping
+import gzip
+import json
+import os
+
+import numpy as np
+
+store_version = 1
+
+
+def iter_pieces(dataset_path, block_size=1 << 20):
+    """
+    Read the pieces of a JSON dataset one by one, without loading the whole file. The dataset is a JSON array of
+    pieces, plain or gzipped (if the path ends with .gz).
+
+    Only the piece being parsed, and one block of the file, are held in memory.
+
+    :param dataset_path: The path of the dataset, like dataset/dataset_rdb_100.jams.json.gz
+    :param block_size: Number of characters read from the file at once
+    :return: A generator of pieces (dict), in the order of the file
+    """
+    decoder = json.JSONDecoder()
+    opener = gzip.open if dataset_path.endswith(".gz") else open
+
+    with opener(dataset_path, "rt", encoding="utf-8") as dataset_file:
+        buffer = dataset_file.read(block_size)
+        eof = not buffer
+        pos = 0
+        state = "start"  # "start": before "[", "first": after "[", "after": after a piece, "value": after ","
+
+        while True:
+            # Skip whitespaces, reading more if the buffer is exhausted
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                buffer = dataset_file.read(block_size)
+                eof = not buffer
+                pos = 0
+
+            if pos == len(buffer):
+                raise IOError(f"Unexpected end of the dataset {dataset_path}")
+
+            char = buffer[pos]
+            if state == "start":
+                if char != "[":
+                    raise IOError(f"The dataset {dataset_path} is not a JSON array")
+                pos += 1
+                state = "first"
+                continue
+            if state in ("first", "after") and char == "]":
+                return
+            if state == "after":
+                if char != ",":
+                    raise IOError(f"Expected ',' or ']' after a piece of the dataset {dataset_path}, found {char!r}")
+                pos += 1
+                state = "value"
+                continue
+
+            # Decode one piece. If the buffer ends before the end of the piece, read more (at least as much as already
+            # buffered, so that a big piece is not decoded again and again) and retry
+            try:
+                piece, end = decoder.raw_decode(buffer, pos)
+                if end == len(buffer) and not eof:
+                    # A number could continue in the next block
+                    raise json.JSONDecodeError("Value may be truncated", buffer, end)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                buffer = buffer[pos:]
+                pos = 0
+                more = dataset_file.read(max(block_size, len(buffer)))
+                eof = not more
+                buffer += more
+                continue
+
+            yield piece
+            pos = end
+            state = "after"
+            # Drop the parsed part of the buffer
+            if pos > block_size:
+                buffer = buffer[pos:]
+                pos = 0
+
+
+def iter_claraprints(dataset_path, algos=None, block_size=1 << 20):
+    """
+    Read the claraprints of a JSON dataset one by one, without loading the whole file. See iter_pieces.
+
+    :param dataset_path: The path of the dataset, like dataset/dataset_rdb_100.jams.json.gz
+    :param algos: Optional, the claraprints to read, like ["120s_chords_chordino"]. Default is all
+    :param block_size: See iter_pieces
+    :return: A generator of (piece id, ytb id, algo, claraprint). The piece id is like
+      utils_experiments.get_full_piece_id, and algo is the name of the claraprint in the dataset, like
+      "120s_chords_chordino"
+    """
+    for rdb_id, movement_id, recording in _recordings(iter_pieces(dataset_path, block_size)):
+        piece_id = rdb_id + ("-" + movement_id if movement_id else "")
+        ytb_id = recording["url"].split("?v=")[-1]
+        for algo, claraprint in recording["claraprints"].items():
+            if algos is None or algo in algos:
+                yield piece_id, ytb_id, algo, claraprint
+
+
+def _recordings(pieces):
+    """
+    :param pieces: The pieces of a dataset, either in the JAMS dataset (piece["sandbox"]["recordings"]) or in the
+      plain dataset (piece["recordings"])
+    :return: A generator of (rdb id, movement id, recording). The movement id is "" if the piece has no movement
+    """
+    for piece in pieces:
+        piece = piece.get("sandbox", piece)
+        rdb_id = str(piece["rdb_id_piece"])
+        movement_id = str(piece.get("rdb_id_movement", ""))
+        for recording in piece["recordings"]:
+            yield rdb_id, movement_id, recording
+
+
+def write_store(pieces, directory, columns=None):
+    """
+    Convert a dataset to a store. Claraprints are written as they come, so pieces can be a generator.
+
+    :param pieces: The pieces of the dataset, like the result of json.load on dataset/dataset_rdb_100.jams.json
+    :param directory: The directory of the store. Created if it does not exist
+    :param columns: The claraprints to store, like ["120s_chords_chordino"]. Default is all the claraprints of the
+      first recording
+    :return: The number of recordings stored
+    """
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    offsets = array("q", [0])
+    metadata = {"rdb_ids": [], "movements": [], "ytb_ids": [], "urls": []}
+    with open(os.path.join(directory, "claraprints.bin"), "wb") as blob:
+        for rdb_id, movement_id, recording in _recordings(pieces):
+            if columns is None:
+                columns = sorted(recording["claraprints"])
+
+            for column in columns:
+                # A claraprint missing in the dataset is stored as an empty string
+                offsets.append(offsets[-1] + blob.write(recording["claraprints"].get(column, "").encode("utf-8")))
+
+            metadata["rdb_ids"].append(rdb_id)
+            metadata["movements"].append(movement_id)
+            metadata["ytb_ids"].append(recording["url"].split("?v=")[-1])
+            metadata["urls"].append(recording["url"])
+
+    np.save(os.path.join(directory, "offsets.npy"), np.frombuffer(offsets, dtype=np.int64))
+    for name, values in metadata.items():
+        np.save(os.path.join(directory, name + ".npy"), np.array(values, dtype=str))
+
+    num_recordings = len(metadata["urls"])
+    with open(meta_path, "w") as meta:
+        json.dump({"version": store_version, "columns": columns or [], "num_recordings": num_recordings}, meta)
+
+    return num_recordings
+
+
+class DatasetStore(object):
+    """
+    Read access to a store written by write_store. Files are memory-mapped: opening is immediate, and a claraprint is
+    only read from the disk (and decoded) when accessed.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: The directory of the store
+        """
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            raise IOError(f"No dataset store in {directory}. Build it with: python -m dataset_store <dataset> "
+                          f"{directory}")
+
+        with open(meta_path, "r") as meta_file:
+            meta = json.load(meta_file)
+        if meta["version"] != store_version:
+            raise IOError(f"Dataset store version {meta['version']} is not supported, build it again")
+
+        self.directory = directory
+        self.columns = meta["columns"]
+        self._column_indexes = {column: idx for idx, column in enumerate(self.columns)}
+        self._num_recordings = meta["num_recordings"]
+
+        blob_path = os.path.join(directory, "claraprints.bin")
+        # A zero-length file cannot be memory-mapped
+        if os.path.getsize(blob_path):
+            self._blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            self._blob = np.empty(0, dtype=np.uint8)
+        self._offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self.rdb_ids = np.load(os.path.join(directory, "rdb_ids.npy"), mmap_mode="r")
+        self.movements = np.load(os.path.join(directory, "movements.npy"), mmap_mode="r")
+        self.ytb_ids = np.load(os.path.join(directory, "ytb_ids.npy"), mmap_mode="r")
+        self.urls = np.load(os.path.join(directory, "urls.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return self._num_recordings
+
+    def _column_index(self, column):
+        if column not in self._column_indexes:
+            raise IOError(f"Claraprint {column} is not in the dataset store. Available: {', '.join(self.columns)}")
+
+        return self._column_indexes[column]
+
+    def claraprint_bytes(self, row, column):
+        """
+        :param row: The index of the recording
+        :param column: The claraprint, like "120s_chords_chordino"
+        :return: The utf-8 encoded claraprint, as a view on the memory-mapped file (no copy)
+        """
+        cell = row * len(self.columns) + self._column_index(column)
+        return self._blob[self._offsets[cell]:self._offsets[cell + 1]]
+
+    def claraprint(self, row, column):
+        """
+        :param row: The index of the recording
+        :param column: The claraprint, like "120s_chords_chordino"
+        :return: The claraprint (str)
+        """
+        return self.claraprint_bytes(row, column).tobytes().decode("utf-8")
+
+    def iter_column(self, column):
+        """
+        :param column: The claraprint, like "120s_chords_chordino"
+        :return: A generator of (row, claraprint) for all the recordings, in order
+        """
+        idx_column = self._column_index(column)
+        num_columns = len(self.columns)
+        for row in range(self._num_recordings):
+            cell = row * num_columns + idx_column
+            yield row, self._blob[self._offsets[cell]:self._offsets[cell + 1]].tobytes().decode("utf-8")
+
+    def full_piece_id(self, row):
+        """
+        Same as utils_experiments.get_full_piece_id.
+
+        :param row: The index of the recording
+        :return: The rdb piece id, followed by a dash and the movement id if the piece has a movement
+        """
+        movement_id = str(self.movements[row])
+        return str(self.rdb_ids[row]) + ("-" + movement_id if movement_id else "")
+
+    def recording(self, row):
+        """
+        :param row: The index of the recording
+        :return: A read-only dict-like view of the claraprints of the recording, plus its "url"
+        """
+        return StoreRecording(self, row)
+
+
+class StoreRecording(Mapping):
+    """
+    Claraprints of one recording of a DatasetStore, indexed by column (like "120s_chords_chordino"), plus its "url",
+    as in the recordings of the dataset. Claraprints are read when accessed.
+    """
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __getitem__(self, key):
+        if key == "url":
+            return str(self._store.urls[self._row])
+        if key not in self._store._column_indexes:
+            raise KeyError(key)
+
+        return self._store.claraprint(self._row, key)
+
+    def __iter__(self):
+        yield from self._store.columns
+        yield "url"
+
+    def __len__(self):
+        return len(self._store.columns) + 1
+
+
+class ClaraprintMapping(Mapping):
+    """
+    Claraprints of one column of a DatasetStore, indexed by any key given per recording. Claraprints are read when
+    accessed, so building the mapping does not read them.
+    """
+
+    def __init__(self, store, column, keys):
+        """
+        :param store: A DatasetStore
+        :param column: The claraprint, like "120s_chords_chordino"
+        :param keys: The key of each recording of the store, in order
+        """
+        store._column_index(column)
+        self._store = store
+        self._column = column
+        self._rows = {key: row for row, key in enumerate(keys)}
+
+    def __getitem__(self, key):
+        return self._store.claraprint(self._rows[key], self._column)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a JSON dataset to a memory-mapped dataset store")
+    parser.add_argument("dataset", help="The JSON dataset, plain or gzipped, like dataset/dataset_rdb_100.jams.json.gz")
+    parser.add_argument("store", help="The directory of the store to write, like dataset/dataset_rdb_100.store")
+    parser.add_argument("--columns", nargs="+", default=None, help="Claraprints to store (default: all)")
+    args = parser.parse_args()
+
+    num_recordings = write_store(iter_pieces(args.dataset), args.store, columns=args.columns)
+    print(f"recordings={num_recordings}")
+
+
+if __name__ == "__main__":
+    main()
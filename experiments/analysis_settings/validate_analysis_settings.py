@@ -0,0 +1,132 @@
+"""
+Measure what a lower analysis sample rate, or a faster resampler, changes to the claraprints (see
+extract_information.use_analysis_settings).
+
+Each audio file is fingerprinted twice for each algo: with the baseline settings (44100 Hz, "kaiser_best"), and with
+the tested settings. The two claraprints are compared with distance_levenshtein, normalized by the length of the
+longest one: 1 means identical claraprints. Decoding and extraction are timed for both settings.
+
+The output looks like:
+
+    algo=melody_melodia,sr=22050,res_type=polyphase,files=20,similarity=0.97,min_similarity=0.91,identical=0.45,decode=0.52,extract=0.48
+
+decode and extract are the time spent with the tested settings divided by the time spent with the baseline settings.
+
+Usage:
+
+    PYTHONPATH=. python experiments/analysis_settings/validate_analysis_settings.py /data/audio --sr 22050 --res-type polyphase
+    PYTHONPATH=. python experiments/analysis_settings/validate_analysis_settings.py manifest.txt --algos melody_melodia --duration 120
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from batch import list_audio_files
+from extract_information import analysis_res_type, analysis_sr, load_audio
+from fingerprint import all_algos, claraprint_from_pitches, extract_pitches
+from utils import distance_levenshtein
+
+
+def similarity(claraprint_1, claraprint_2):
+    """
+    :return: distance_levenshtein of the two claraprints, divided by the length of the longest one. 1 if identical
+    """
+    longest = max(len(claraprint_1), len(claraprint_2))
+    if longest == 0:
+        return 1.
+
+    return distance_levenshtein(claraprint_1, claraprint_2) / longest
+
+
+def fingerprint_timed(audio_path, algos, sr, res_type, duration=None):
+    """
+    Compute the claraprints of the algos for one audio file, at the given sample rate and with the given resampler.
+
+    :return: A tuple (dict algo -> claraprint, decoding time, dict algo -> extraction time), times in seconds
+    """
+    t1 = time.perf_counter()
+    y, sr = load_audio(audio_path, sr=sr, duration=duration, res_type=res_type)
+    decode_time = time.perf_counter() - t1
+
+    claraprints_ = {}
+    extract_times = {}
+    for algo in algos:
+        t1 = time.perf_counter()
+        pitches = extract_pitches(algo, y=y, sr=sr)
+        extract_times[algo] = time.perf_counter() - t1
+        claraprints_[algo] = claraprint_from_pitches(pitches, algo)
+
+    return claraprints_, decode_time, extract_times
+
+
+def validate(audio_paths, algos=all_algos, sr=22050, res_type="polyphase", duration=None):
+    """
+    Compare the claraprints computed with the given settings to the ones computed with the baseline settings.
+
+    :param audio_paths: The audio files
+    :param algos: The algos to compare
+    :param sr: The tested sample rate
+    :param res_type: The tested resampler, see librosa.resample
+    :param duration: Only fingerprint the first duration seconds of each file, like the dataset (30 or 120)
+    :return: A list of dict, one per algo, with the similarities of the claraprints, and the ratios of the decoding
+      and extraction times (tested / baseline)
+    """
+    similarities = {algo: [] for algo in algos}
+    times = {"baseline": {"decode": 0., "extract": dict.fromkeys(algos, 0.)},
+             "tested": {"decode": 0., "extract": dict.fromkeys(algos, 0.)}}
+
+    for audio_path in audio_paths:
+        results = {}
+        for name, (settings_sr, settings_res_type) in [("baseline", (analysis_sr, analysis_res_type)),
+                                                       ("tested", (sr, res_type))]:
+            claraprints_, decode_time, extract_times = fingerprint_timed(audio_path, algos, settings_sr,
+                                                                         settings_res_type, duration)
+            results[name] = claraprints_
+            times[name]["decode"] += decode_time
+            for algo in algos:
+                times[name]["extract"][algo] += extract_times[algo]
+
+        for algo in algos:
+            similarities[algo].append(similarity(results["baseline"][algo], results["tested"][algo]))
+
+    rows = []
+    for algo in algos:
+        algo_similarities = np.array(similarities[algo])
+        rows.append({
+            "algo": algo,
+            "sr": sr,
+            "res_type": res_type,
+            "files": len(algo_similarities),
+            "similarity": float(algo_similarities.mean()),
+            "min_similarity": float(algo_similarities.min()),
+            "identical": float((algo_similarities == 1.).mean()),
+            # The decoding is shared by all algos
+            "decode": times["tested"]["decode"] / times["baseline"]["decode"],
+            "extract": times["tested"]["extract"][algo] / times["baseline"]["extract"][algo]
+        })
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare claraprints computed at another sample rate or with another "
+                                                 "resampler to the 44100 Hz baseline")
+    parser.add_argument("source", help="A directory of audio files, or a manifest with one audio path per line")
+    parser.add_argument("--algos", nargs="+", default=all_algos, choices=all_algos, help="Algos to compare")
+    parser.add_argument("--sr", type=int, default=22050, help="Tested sample rate")
+    parser.add_argument("--res-type", default="polyphase", help="Tested resampler, see librosa.resample")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Only fingerprint the first seconds of each file, like 30 or 120 (default: whole file)")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    rows = validate(list_audio_files(args.source), args.algos, args.sr, args.res_type, args.duration)
+    for row in rows:
+        print(",".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                       for key, value in row.items()))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(rows, output, indent=2)
@@ -2,51 +2,53 @@
 Return an average distance based on a given algorithm (like levensthein) between all pairs in a given clique.
 
 This is not really an experiment but a measure. This will show that melodies are much more distant within a clique
-than chords are. This is not testing the distance of works not in that clique.
+than chords are. The distance between recordings of different cliques is also measured, for comparison.
+
+All pairs of recordings of the dataset are compared at once with similarity.similarity_matrix, using all the CPUs.
 """
 import json
-from compute_fingerprints import distance_levenshtein, distance_commonwords, distance_commonwords_ponderation
+from utils import distance_levenshtein, distance_commonwords, distance_commonwords_ponderation
+from similarity import similarity_matrix
 import numpy as np
 
-clique_rdb_id = None
-cliques = {}
-
 # Consider the claraprints are already computed in the dataset
 # Available at piece["recordings"][n]["claraprints"]
 duration = 120
 algos = ["chords_chordino", "chords_crema", "melody_melodia", "melody_piptrack"]
-dataset = json.load(open("../../dataset/dataset_rdb_100.jams.json", "r"))
 # dist_algos = [distance_levenshtein, distance_commonwords, distance_commonwords_ponderation]
 dist_algos = [distance_levenshtein, distance_commonwords]
 
-for algo in algos:
-    all_scores = np.zeros((4, 1))
-    scores = np.zeros((len(dist_algos), 100), dtype=float)
-
-    num_work = -1
-    for piece in dataset:
-        num_work += 1
-
-        clique = [c[f"{duration}s_{algo}"] for c in [r["claraprints"] for r in piece["sandbox"]["recordings"]]]
-
+if __name__ == "__main__":
+    dataset = json.load(open("../../dataset/dataset_rdb_100.jams.json", "r"))
+
+    for algo in algos:
+        # All recordings of the dataset, and the work (clique) of each one
+        fingerprints = []
+        works = []
+        for num_work, piece in enumerate(dataset):
+            for recording in piece["sandbox"]["recordings"]:
+                fingerprints.append(recording["claraprints"][f"{duration}s_{algo}"])
+                works.append(num_work)
+        works = np.array(works)
+
+        # Pairs of different recordings of the same work, and pairs of recordings of different works
+        upper = np.triu(np.ones((len(works), len(works)), dtype=bool), k=1)
+        same_work = works[:, np.newaxis] == works[np.newaxis, :]
+
+        scores = np.zeros((len(dist_algos), len(dataset)), dtype=float)
+        cross_scores = np.zeros(len(dist_algos), dtype=float)
         for idx_algo, dist_algo in enumerate(dist_algos):
-            distances = [
-                dist_algo(clique[0], clique[1]),
-                dist_algo(clique[0], clique[2]),
-                dist_algo(clique[0], clique[3]),
-                dist_algo(clique[0], clique[4]),
-                dist_algo(clique[1], clique[2]),
-                dist_algo(clique[1], clique[3]),
-                dist_algo(clique[1], clique[4]),
-                dist_algo(clique[2], clique[3]),
-                dist_algo(clique[2], clique[4]),
-                dist_algo(clique[3], clique[4])
-            ]
-            scores[idx_algo, num_work] = sum(distances)/len(distances)
-
-    print(algo)
-    print([d.__name__ for d in dist_algos])
-    print(scores.mean(axis=1))
-    print(scores.min(axis=1))
-    print(scores.max(axis=1))
-    print(scores.std(axis=1))
+            similarities = similarity_matrix(fingerprints, dist_algo)
+
+            for num_work in range(len(dataset)):
+                in_work = works == num_work
+                scores[idx_algo, num_work] = similarities[np.ix_(in_work, in_work)][np.triu_indices(in_work.sum(), k=1)].mean()
+            cross_scores[idx_algo] = similarities[upper & ~same_work].mean()
+
+        print(algo)
+        print([d.__name__ for d in dist_algos])
+        print(scores.mean(axis=1))
+        print(scores.min(axis=1))
+        print(scores.max(axis=1))
+        print(scores.std(axis=1))
+        print("cross-clique mean", cross_scores)
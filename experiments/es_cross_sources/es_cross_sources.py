@@ -12,16 +12,18 @@ the final FP will be "abc cbf aba hfg opq rsv wzq qqp".
 from utils_experiments import get_all_fingerprints_by_rdb_id_multiple, get_all_fingerprints, fingerprint_from_n_sources_multiple_algos, fingerprint_from_one_random
 from experiments.es_helper import es_search, create_index, store_one_fingerprint, generic_score_by_es_search_multiple_algo, es_refresh
 from experiments.es_helper import es_search_shingle, create_index_shingle, store_one_fingerprint_shingle
+from experiments.es_helper import es_msearch_shingle, generic_score_by_es_msearch_multiple_algo
 from collections import namedtuple
 import numpy as np
 from fingerprint import get_letters_set_from_algo
 
 # All parameters are not useful here. It's copied from es_multiple_fp_generated experiment
 # algos: It's now a list of algos to combine, for instance ["chord_chordino", "melody_melodia"]
+# msearch_func: optional, like es_msearch_shingle. When given, used instead of search_func to send queries by batches
 fields   = ['algos', 'duration', 'range_words', 'num_sources', 'num_bests',
-            'search_func', 'ingest_func',         'createindex_func', 'rounds', 'combination_mode']
+            'search_func', 'ingest_func',         'createindex_func', 'rounds', 'combination_mode', 'refresh_func', 'msearch_func']
 defaults = (None,    120,         [range(3, 4)], [1],            [10, 5, 1],
-            es_search,     store_one_fingerprint, create_index,       10,        'union')
+            es_search,     store_one_fingerprint, create_index,       10,        'union',            es_refresh,     None)
 Config = namedtuple('Config', fields)
 Config.__new__.__defaults__ = defaults
 
@@ -59,16 +61,25 @@ if __name__ == "__main__":
                         # Store final_fgpt with this rdb_id
                         config.ingest_func(rdb_id, used_ytb_ids, final_fgpt)
 
-                    es_refresh()
+                    config.refresh_func()
 
                     # Search by each algo used to compute this FP
-                    avg_scores = generic_score_by_es_search_multiple_algo(config.search_func,
-                                                                          used_ytb_ids=ytbs_used,
-                                                                          num_bests=config.num_bests,
-                                                                          range_=range_words,
-                                                                          all_fingerprints=all_fingerprints_by_rdb_by_algo,
-                                                                          claraprints=claraprints,
-                                                                          combination_mode=config.combination_mode)
+                    if config.msearch_func:
+                        avg_scores, _latencies = generic_score_by_es_msearch_multiple_algo(config.msearch_func,
+                                                                              used_ytb_ids=ytbs_used,
+                                                                              num_bests=config.num_bests,
+                                                                              range_=range_words,
+                                                                              all_fingerprints=all_fingerprints_by_rdb_by_algo,
+                                                                              claraprints=claraprints,
+                                                                              combination_mode=config.combination_mode)
+                    else:
+                        avg_scores = generic_score_by_es_search_multiple_algo(config.search_func,
+                                                                              used_ytb_ids=ytbs_used,
+                                                                              num_bests=config.num_bests,
+                                                                              range_=range_words,
+                                                                              all_fingerprints=all_fingerprints_by_rdb_by_algo,
+                                                                              claraprints=claraprints,
+                                                                              combination_mode=config.combination_mode)
 
                     all_avg_scores.append(avg_scores)
 
@@ -3,13 +3,38 @@ This file contains ES (elasticseach) functions that can be reused in multiple ES
 Each experiment can override one of these methods for its particular need
 """
 
-from elasticsearch import Elasticsearch
 from utils_experiments import get_all_fingerprints
 from utils import fingerprints_to_words
 from config import es_host, es_port, es_index
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+import numpy as np
 import time
 
-es = Elasticsearch([{'host': es_host, 'port': es_port}])
+_es = None
+
+
+def es_client():
+    """
+    :return: The Elasticsearch client, created at the first call. The elasticsearch package is only needed by the
+      functions querying ES: the scoring functions of this file can be used with the indexes of memory_helper.py
+      without it
+    """
+    global _es
+    if _es is None:
+        from elasticsearch import Elasticsearch
+        _es = Elasticsearch([{'host': es_host, 'port': es_port}])
+    return _es
+
+
+def use_index(name):
+    """
+    Use another index for all the functions of this file. Default is es_index of config.py.
+    Experiments running at the same time (see --workers in es_multiple_fp_generated.py) each use their own index.
+    """
+    global es_index
+    es_index = name
 
 
 # ES tools for this experiment
@@ -39,8 +64,17 @@ def create_index(lower, higher):
         }
     }
 
-    es.indices.delete(index=es_index, ignore=404)
-    es.indices.create(index=es_index, body=clara_index_mapping)
+    es_client().indices.delete(index=es_index, ignore=404)
+    es_client().indices.create(index=es_index, body=clara_index_mapping)
+
+
+def delete_index(name=None):
+    """
+    Delete an index, if it exists.
+
+    :param name: Name of the index. Default is the index in use, see use_index
+    """
+    es_client().indices.delete(index=name or es_index, ignore=404)
 
 
 def store_one_fingerprint(rdb_id, ytb_ids, fingerprint):
@@ -50,11 +84,143 @@ def store_one_fingerprint(rdb_id, ytb_ids, fingerprint):
         "ytb_ids": ytb_ids
     }
 
-    es.index(index=es_index, body=body)
+    es_client().index(index=es_index, body=body)
 
 
 def es_refresh():
-    es.indices.refresh(index=es_index)
+    es_client().indices.refresh(index=es_index)
+
+
+@contextmanager
+def suspended_refresh():
+    """
+    Disable the periodic refresh of the index while in this context, and restore it afterwards. Refreshing during a
+    big ingestion slows it down for nothing, as no search is run before the end of the ingestion.
+    The index is refreshed when leaving the context.
+    """
+    settings = es_client().indices.get_settings(index=es_index, name="index.refresh_interval")
+    # None if not set explicitly. Setting None back restores the default value
+    previous = settings.get(es_index, {}).get("settings", {}).get("index", {}).get("refresh_interval")
+
+    es_client().indices.put_settings(index=es_index, body={"index": {"refresh_interval": "-1"}})
+    try:
+        yield
+    finally:
+        es_client().indices.put_settings(index=es_index, body={"index": {"refresh_interval": previous}})
+        es_refresh()
+
+
+def _bulk_one_chunk(actions, max_retries, initial_backoff):
+    """
+    Send one chunk of documents with the _bulk API. Documents rejected because ES is overloaded (429) are sent again,
+    up to max_retries times, waiting initial_backoff seconds, then twice as much each time.
+
+    :return: A tuple (number of documents stored, list of errors)
+    """
+    from elasticsearch import helpers
+
+    num_stored = 0
+    errors = []
+    for ok, item in helpers.streaming_bulk(es_client(), actions, chunk_size=len(actions), max_retries=max_retries,
+                                           initial_backoff=initial_backoff, raise_on_error=False):
+        if ok:
+            num_stored += 1
+        else:
+            errors.append(item)
+
+    return num_stored, errors
+
+
+def store_sources_bulk(sources, chunk_size=500, thread_count=4, max_retries=5, initial_backoff=2):
+    """
+    Store many documents at once with the _bulk API. Documents are sent by chunks, with several chunks sent in
+    parallel. The periodic refresh of the index is suspended during the ingestion (see suspended_refresh).
+
+    :param sources: An iterable of documents (dict). Consumed lazily, can be a generator
+    :param chunk_size: Number of documents sent in one _bulk request
+    :param thread_count: Number of _bulk requests sent in parallel
+    :param max_retries: How many times documents rejected with a 429 (too many requests) are sent again
+    :param initial_backoff: Seconds to wait before the first retry. Doubled at each retry
+    :return: A tuple (number of documents stored, list of errors returned by ES)
+    """
+    def chunks():
+        sources_iter = iter(sources)
+        while True:
+            chunk = list(islice(sources_iter, chunk_size))
+            if not chunk:
+                return
+            yield [{"_index": es_index, "_source": source} for source in chunk]
+
+    num_stored = 0
+    errors = []
+    with suspended_refresh(), ThreadPoolExecutor(max_workers=thread_count) as executor:
+        # Keep a bounded number of chunks in flight, so that documents are not all loaded in memory at once
+        in_flight = []
+        for actions in chunks():
+            in_flight.append(executor.submit(_bulk_one_chunk, actions, max_retries, initial_backoff))
+            if len(in_flight) >= 2 * thread_count:
+                chunk_stored, chunk_errors = in_flight.pop(0).result()
+                num_stored += chunk_stored
+                errors.extend(chunk_errors)
+
+        for future in in_flight:
+            chunk_stored, chunk_errors = future.result()
+            num_stored += chunk_stored
+            errors.extend(chunk_errors)
+
+    return num_stored, errors
+
+
+def store_fingerprints_bulk(documents, chunk_size=500, thread_count=4, max_retries=5, initial_backoff=2):
+    """
+    Store many fingerprints at once with the _bulk API. Same documents as store_one_fingerprint (and
+    store_one_fingerprint_shingle). See store_sources_bulk for the parameters.
+
+    :param documents: An iterable of (rdb_id, ytb_ids, fingerprint). Consumed lazily, can be a generator
+    :return: A tuple (number of documents stored, list of errors returned by ES)
+    """
+    sources = ({
+        "claraprint": " ".join(fingerprint),
+        "rdb_id": rdb_id,
+        "ytb_ids": ytb_ids
+    } for rdb_id, ytb_ids, fingerprint in documents)
+
+    return store_sources_bulk(sources, chunk_size, thread_count, max_retries, initial_backoff)
+
+
+def create_index_segments(lower, higher):
+    """
+    Same as create_index, with the time fields of the segments stored by store_fingerprint_segments.
+    """
+    create_index(lower, higher)
+    es_client().indices.put_mapping(index=es_index, body={
+        "properties": {
+            "start_time": {"type": "float"},
+            "end_time": {"type": "float"}
+        }
+    })
+
+
+def store_fingerprint_segments(recordings, range_, chunk_size=500, thread_count=4, max_retries=5, initial_backoff=2):
+    """
+    Store each segment of the recordings as a separate document, pointing back to its recording. A search (like
+    es_search) then returns the matching segments, with their start_time: the offset of the match in the recording.
+    All recordings are sent in one bulk ingestion, see store_sources_bulk for the other parameters.
+
+    :param recordings: An iterable of (rdb_id, ytb_id, segments), segments being a list of (start time, end time,
+      claraprint) as returned by fingerprint.fgpt_segments. Consumed lazily, can be a generator
+    :param range_: The min and max word length to use to shingle each segment
+    :return: A tuple (number of documents stored, list of errors returned by ES)
+    """
+    sources = ({
+        "claraprint": " ".join(fingerprints_to_words(claraprint_, range_)),
+        "rdb_id": rdb_id,
+        "ytb_ids": [ytb_id],
+        "start_time": start_time,
+        "end_time": end_time
+    } for rdb_id, ytb_id, segments in recordings for start_time, end_time, claraprint_ in segments)
+
+    return store_sources_bulk(sources, chunk_size, thread_count, max_retries, initial_backoff)
 
 
 def es_search(fingerprint, range_):
@@ -66,7 +232,64 @@ def es_search(fingerprint, range_):
     :return: ES results
     """
     words = " ".join(fingerprints_to_words(fingerprint, range_))
-    return es.search(index=es_index, q=words)
+    return es_client().search(index=es_index, q=words)
+
+
+def es_msearch(fingerprints, range_):
+    """
+    Same as es_search, but for several fingerprints sent in one _msearch request.
+
+    :param fingerprints: The fingerprints that will be shingled.
+    :param range_: The min and max word length to use.
+    :return: A list of ES results, in the same order as fingerprints. Each result has its own "took", the time spent
+      by ES on this query in ms
+    """
+    body = []
+    for fingerprint in fingerprints:
+        body.append({"index": es_index})
+        body.append({"query": {"query_string": {"query": " ".join(fingerprints_to_words(fingerprint, range_))}}})
+
+    return es_client().msearch(body=body)["responses"]
+
+
+def latency_percentiles(latencies, mean=None):
+    """
+    :param latencies: A list of query times
+    :param mean: The mean query time to report. Default is the mean of latencies
+    :return: A dict with the mean, and the 50th, 95th and 99th percentiles of the latencies
+    """
+    latencies = np.array(latencies, dtype=float)
+    if len(latencies) == 0:
+        return {"mean": mean or 0., "p50": 0., "p95": 0., "p99": 0.}
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    if mean is None:
+        mean = latencies.mean()
+    return {"mean": float(mean), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def _msearch_in_batches(msearch_function, fingerprints, range_, batch_size):
+    """
+    Run msearch_function on fingerprints, batch_size fingerprints at a time.
+
+    :return: A tuple (list of results in the same order as fingerprints, mean query time in seconds, list of query
+      times in seconds). The mean query time is the time of the _msearch requests measured by the client, like in
+      generic_score_by_es_search, divided by the number of queries. The list has the "took" of each successful
+      result: the time spent on this query alone, to compute percentiles.
+    """
+    results = []
+    total_time = 0.
+    for start in range(0, len(fingerprints), batch_size):
+        batch = fingerprints[start:start + batch_size]
+        t1 = time.time()
+        responses = msearch_function(batch, range_)
+        total_time += time.time() - t1
+        results.extend(responses)
+
+    query_time = total_time / len(fingerprints) if fingerprints else 0.
+    latencies = [res["took"] / 1000 for res in results if "took" in res]
+
+    return results, query_time, latencies
 
 
 def generic_score_by_es_search(search_function, algo, used_ytb_ids, num_bests=[10], duration=120, letters_to_use=1,
@@ -160,6 +383,103 @@ def generic_score_by_es_search_multiple_algo(search_function, used_ytb_ids, comb
     return avgs
 
 
+def generic_score_by_es_msearch(msearch_function, algo, used_ytb_ids, num_bests=[10], duration=120, letters_to_use=1,
+                                range_=range(2, 7), all_fingerprints=None, batch_size=50):
+    """
+    Same as generic_score_by_es_search, but the queries are sent by batches with the _msearch API, instead of one
+    blocking request per fingerprint.
+
+    :param msearch_function: The function to use for search, like es_msearch
+    :param batch_size: Number of fingerprints sent in one _msearch request
+    :return: A tuple (average scores, latencies). latencies is a dict with the mean query time measured by the client,
+      and the p50, p95 and p99 percentiles of the "took" of each query, in seconds (see _msearch_in_batches)
+    """
+    if not all_fingerprints:
+        all_fingerprints = get_all_fingerprints(duration, algo)
+
+    rdb_ids = []
+    fingerprints = []
+    for path, fingerprint in all_fingerprints.items():
+        ytb_id = path.split('/')[-1].split('_', 2)[2].split('.')[0]
+
+        # If this fingerprint has been used for the reference fgpt, ignore it
+        if ytb_id in used_ytb_ids:
+            continue
+
+        rdb_ids.append(path.split('/')[-1].split('_')[1])
+        fingerprints.append(fingerprint)
+
+    results, query_time, latencies = _msearch_in_batches(msearch_function, fingerprints, range_, batch_size)
+
+    avgs = _scores_from_results(rdb_ids, results, num_bests)
+
+    return avgs, latency_percentiles(latencies, mean=query_time)
+
+
+def generic_score_by_es_msearch_multiple_algo(msearch_function, used_ytb_ids, combination_mode, claraprints,
+                                              num_bests=[10], range_=range(2, 7), all_fingerprints=None,
+                                              batch_size=50):
+    """
+    Same as generic_score_by_es_search_multiple_algo, but the queries are sent by batches with the _msearch API.
+
+    :param msearch_function: The function to use for search, like es_msearch_shingle
+    :param batch_size: Number of fingerprints sent in one _msearch request
+    :return: A tuple (average scores, latencies), see generic_score_by_es_msearch
+    """
+    if not all_fingerprints:
+        raise IOError("Not supported. Provide all_fingerprints.")
+
+    from utils_experiments import fingerprint_from_n_sources_multiple_algos
+
+    rdb_ids = []
+    fingerprints = []
+    for rdb_id, gpfgpts in all_fingerprints.items():
+        # From this group, remove the recordings that were used for ingestion
+        clean_gpfgpts = [fgpts for fgpts in gpfgpts if fgpts["url"].split('?v=')[-1] not in used_ytb_ids]
+
+        # Build combinatory fingerprint from this recording
+        fingerprint, _ytbid = fingerprint_from_n_sources_multiple_algos(clean_gpfgpts, 1, range_, combination_mode,
+                                                                        claraprints)
+        rdb_ids.append(rdb_id)
+        fingerprints.append(fingerprint)
+
+    results, query_time, latencies = _msearch_in_batches(msearch_function, fingerprints, range_, batch_size)
+
+    avgs = _scores_from_results(rdb_ids, results, num_bests)
+
+    return avgs, latency_percentiles(latencies, mean=query_time)
+
+
+def _scores_from_results(rdb_ids, results, num_bests):
+    """
+    :param rdb_ids: The expected rdb_id of each query
+    :param results: The ES result of each query. A failed query of an _msearch request ({"error": ..., "status": ...})
+      counts as not found
+    :param num_bests: See generic_score_by_es_search
+    :return: For each value of num_bests, the ratio of queries with the expected rdb_id in the num_best first results
+    """
+    avgs = [.0]*len(num_bests)
+    scores = []
+    for n in num_bests:
+        scores.append([])
+
+    errors = [res["error"] for res in results if "error" in res]
+    if errors:
+        print(f"{len(errors)} of {len(results)} queries failed, counted as not found. First error: {errors[0]}")
+
+    for rdb_id, res in zip(rdb_ids, results):
+        rdb_ids_in_results = [] if "error" in res else [r['_source']['rdb_id'] for r in res['hits']['hits']]
+
+        for idx_best, num_best in enumerate(num_bests):
+            found = int(rdb_id in rdb_ids_in_results[:num_best])
+            scores[idx_best].append(found)
+
+    for idx_best, num_best in enumerate(num_bests):
+        avgs[idx_best] = sum(scores[idx_best]) / len(scores[idx_best])
+
+    return avgs
+
+
 def create_index_shingle(lower, upper):
     clara_index_mapping = {
         "settings": {
@@ -212,10 +532,10 @@ def create_index_shingle(lower, upper):
         }
     }
 
-    es.indices.delete(index=es_index, ignore=404)
+    es_client().indices.delete(index=es_index, ignore=404)
     clara_index_mapping["settings"]["analysis"]["filter"]["my_shingle_filter"]["min_shingle_size"] = lower
     clara_index_mapping["settings"]["analysis"]["filter"]["my_shingle_filter"]["max_shingle_size"] = upper
-    es.indices.create(index=es_index, body=clara_index_mapping)
+    es_client().indices.create(index=es_index, body=clara_index_mapping)
 
 
 def store_one_fingerprint_shingle(rdb_id, ytb_ids, fingerprint):
@@ -225,7 +545,7 @@ def store_one_fingerprint_shingle(rdb_id, ytb_ids, fingerprint):
         "ytb_ids": ytb_ids
     }
 
-    es.index(index=es_index, body=body)
+    es_client().index(index=es_index, body=body)
 
 
 def es_search_shingle(fingerprint, range_):
@@ -235,4 +555,20 @@ def es_search_shingle(fingerprint, range_):
     :param range_: Unused, but here for genericity
     :return: ES results
     """
-    return es.search(index=es_index, q=" ".join(fingerprint))
+    return es_client().search(index=es_index, q=" ".join(fingerprint))
+
+
+def es_msearch_shingle(fingerprints, range_):
+    """
+    Same as es_search_shingle, but for several fingerprints sent in one _msearch request.
+
+    :param fingerprints: The fingerprints. Will be spaced
+    :param range_: Unused, but here for genericity
+    :return: A list of ES results, in the same order as fingerprints. Each result has its own "took", see es_msearch
+    """
+    body = []
+    for fingerprint in fingerprints:
+        body.append({"index": es_index})
+        body.append({"query": {"query_string": {"query": " ".join(fingerprint)}}})
+
+    return es_client().msearch(body=body)["responses"]
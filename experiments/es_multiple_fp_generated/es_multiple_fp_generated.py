@@ -12,8 +12,16 @@ parameter to the experiment: combination_mode)
 
 from utils_experiments import get_all_fingerprints_by_rdb_id, get_all_fingerprints, fingerprint_from_n_sources, fingerprint_from_one_random
 from experiments.es_helper import es_search, create_index, store_one_fingerprint, generic_score_by_es_search, es_refresh, es_search_shingle, store_one_fingerprint_shingle, create_index_shingle
+from experiments.es_helper import es_msearch, generic_score_by_es_msearch, use_index, delete_index
+from experiments.memory_helper import memory_search, create_index_memory, store_one_fingerprint_memory, memory_refresh
+from experiments.memory_helper import lsh_search, create_index_lsh, store_one_fingerprint_lsh, lsh_refresh, lsh_search_levenshtein
+from config import es_index
 from collections import namedtuple
+from multiprocessing import Manager, Pool, cpu_count
+import argparse
+import csv
 import numpy as np
+import random
 import time
 
 """
@@ -35,15 +43,18 @@ Description of a config:
 - ingest_func: reference to a function to ingest a document (claraprint) inside the Elasticsearch index. Such functions
   are to be found in the file experiments.es_helper.py.
 - createindex_func: reference to a function to create the Elasticsearch index.
+- refresh_func: reference to a function to refresh the index after ingestion, before searching.
+- msearch_func: optional reference to a function searching several fingerprints at once, like es_msearch. When given,
+  it is used instead of search_func, and the p50, p95 and p99 query times are displayed in the results.
 - rounds: number of times the configuration is run. Because the works are taken randomly in the dataset, it's worth
   running the config several times to consolidate the result.
 - combination_mode: when several fingerprints are used (num_sources > 1), how do we combine the fingerprint, can be
   'union' or 'intersection'. This is implemented in the fingerprint_from_n_sources function.
 """
 fields   = ['algo', 'duration', 'letters_to_use', 'range_words', 'num_sources', 'num_bests', 'fingerprint_from_one_source',
-            'search_func', 'ingest_func',         'createindex_func', 'rounds', 'combination_mode']
+            'search_func', 'ingest_func',         'createindex_func', 'rounds', 'combination_mode', 'refresh_func', 'msearch_func']
 defaults = (None,   120,        None,             [range(3, 4)], [1],            [10, 5, 1], fingerprint_from_n_sources,
-            es_search,     store_one_fingerprint, create_index,       10,        'union')
+            es_search,     store_one_fingerprint, create_index,       10,        'union',            es_refresh,     None)
 Config = namedtuple('Config', fields)
 Config.__new__.__defaults__ = defaults
 
@@ -85,6 +96,24 @@ configs_to_run = [
 #            num_sources=[1]),
 # ]
 
+# In-process index (no Elasticsearch needed)
+# configs_to_run = [
+#     Config(algo="chords_chordino", duration=120, letters_to_use=1, range_words=[range(2, 8)], num_sources=[1],
+#            search_func=memory_search, ingest_func=store_one_fingerprint_memory, createindex_func=create_index_memory,
+#            refresh_func=memory_refresh),
+# ]
+
+# MinHash + LSH candidates, re-ranked by common words (compare recall with the ES configs above)
+# configs_to_run = [
+#     Config(algo="chords_chordino", duration=120, letters_to_use=1, range_words=[range(2, 8)], num_sources=[1],
+#            search_func=lsh_search, ingest_func=store_one_fingerprint_lsh, createindex_func=create_index_lsh,
+#            refresh_func=lsh_refresh),
+#     # Candidates re-ranked by Levenshtein distance, which needs the plain fingerprints
+#     Config(algo="chords_chordino", duration=120, letters_to_use=1, range_words=[range(2, 8)], num_sources=[1],
+#            search_func=lsh_search_levenshtein, ingest_func=store_one_fingerprint_lsh, createindex_func=create_index_lsh,
+#            refresh_func=lsh_refresh, fingerprint_from_one_source=fingerprint_from_one_random),
+# ]
+
 # Num sources
 # configs_to_run = [
 #     Config(algo="chords_chordino", duration=120, letters_to_use=1, range_words=[range(2, 8)], num_sources=[1, 2, 3, 4]),
@@ -94,63 +123,188 @@ configs_to_run = [
 # ]
 
 
-# Run experiment
-if __name__ == "__main__":
+# Fingerprints of the dataset, loaded once per process by _fingerprints
+_all_fingerprints = {}
+
 
-    for config in configs_to_run:
+def _fingerprints(config):
+    """
+    :return: A tuple (all fingerprints, all fingerprints grouped by rdb id) for the duration and algo of config
+    """
+    key = (config.duration, config.algo, config.letters_to_use)
+    if key not in _all_fingerprints:
         all_fingerprint = get_all_fingerprints(config.duration, config.algo)
-        all_fingerprints_by_rdb = get_all_fingerprints_by_rdb_id(config.duration, config.letters_to_use, config.algo, all_fingerprint)
+        all_fingerprints_by_rdb = get_all_fingerprints_by_rdb_id(config.duration, config.letters_to_use, config.algo,
+                                                                 all_fingerprint)
+        _all_fingerprints[key] = (all_fingerprint, all_fingerprints_by_rdb)
+
+    return _all_fingerprints[key]
+
+
+def run_round(job):
+    """
+    Run one round of a configuration: create the index, ingest one fingerprint per work, and search all the others.
+
+    :param job: A tuple (job id, config, num_sources, range_words)
+    :return: A tuple (job id, scores for each num_bests, average insertion time, average query time, query time
+      percentiles or None if the config has no msearch_func)
+    """
+    job_id, config, num_sources, range_words = job
+    all_fingerprint, all_fingerprints_by_rdb = _fingerprints(config)
+
+    config.createindex_func(list(range_words)[0], list(range_words)[-1])
+    ytbs_used = []
+    time_insertion = 0
+    for rdb_id, fgpts in all_fingerprints_by_rdb.items():
+        if num_sources == 1:
+            final_fgpt, used_ytb_ids = config.fingerprint_from_one_source(fgpts, num_sources, range_words, config.combination_mode)
+        else:
+            final_fgpt, used_ytb_ids = fingerprint_from_n_sources(fgpts, num_sources, range_words, config.combination_mode)
+            ytbs_used.extend(used_ytb_ids)
+
+        # Store final_fgpt with this rdb_id
+        t1 = time.time()
+        config.ingest_func(rdb_id, used_ytb_ids, final_fgpt)
+        time_insertion += (time.time() - t1)
+    avg_time_insertion = time_insertion / len(all_fingerprints_by_rdb.items())
+
+    config.refresh_func()
+    query_latencies = None
+    if config.msearch_func:
+        avg_scores, query_latencies = generic_score_by_es_msearch(config.msearch_func,
+                                               algo=config.algo,
+                                               used_ytb_ids=ytbs_used,
+                                               num_bests=config.num_bests,
+                                               duration=config.duration,
+                                               letters_to_use=config.letters_to_use,
+                                               range_=range_words,
+                                               all_fingerprints=all_fingerprint)
+        # Measured by the client, like the query time of generic_score_by_es_search
+        avg_query_time = query_latencies["mean"]
+    else:
+        avg_scores, avg_query_time = generic_score_by_es_search(config.search_func,
+                                               algo=config.algo,
+                                               used_ytb_ids=ytbs_used,
+                                               num_bests=config.num_bests,
+                                               duration=config.duration,
+                                               letters_to_use=config.letters_to_use,
+                                               range_=range_words,
+                                               all_fingerprints=all_fingerprint)
+
+    return job_id, avg_scores, avg_time_insertion, avg_query_time, query_latencies
+
+
+def _init_worker(index_names):
+    # Each process has its own index (ES index, or in-process index of memory_helper), used by all its rounds
+    use_index(index_names.get())
+    # Forked processes share the state of the random generator: without a new seed, they would pick the same recordings
+    random.seed()
+
+
+def run_configs(configs, workers=1):
+    """
+    Run all rounds of all configurations, for all their num_sources and range_words, in a pool of processes.
+
+    :param configs: A list of Config
+    :param workers: Number of processes. With 1, everything runs in this process, on the index es_index of config.py.
+      Otherwise, each process uses its own index, named es_index followed by the number of the process. These indexes
+      are deleted at the end of the run. None for the number of CPUs
+    :return: A list of dict, one per configuration, num_sources and range_words, in the order of configs. Scores and
+      times are averaged over the rounds
+    """
+    rows = []
+    jobs = []
+    for config in configs:
         for num_sources in config.num_sources:
             for range_words in config.range_words:
-                all_avg_scores = []  # average score from all rounds
-                avg_time_insertion = 0
-                avg_time_query = 0
-
-                for round in range(1, config.rounds + 1):
-                    config.createindex_func(list(range_words)[0], list(range_words)[-1])
-                    ytbs_used = []
-                    for rdb_id, fgpts in all_fingerprints_by_rdb.items():
-                        if num_sources == 1:
-                            final_fgpt, used_ytb_ids = config.fingerprint_from_one_source(fgpts, num_sources, range_words, config.combination_mode)
-                        else:
-                            final_fgpt, used_ytb_ids = fingerprint_from_n_sources(fgpts, num_sources, range_words, config.combination_mode)
-                            ytbs_used.extend(used_ytb_ids)
-
-                        # Store final_fgpt with this rdb_id
-                        t1 = time.time()
-                        config.ingest_func(rdb_id, used_ytb_ids, final_fgpt)
-                        avg_time_insertion += (time.time() - t1)
-                    avg_time_insertion /= len(all_fingerprints_by_rdb.items())
-
-                    es_refresh()
-                    avg_scores, avg_query_time = generic_score_by_es_search(config.search_func,
-                                                           algo=config.algo,
-                                                           used_ytb_ids=ytbs_used,
-                                                           num_bests=config.num_bests,
-                                                           duration=config.duration,
-                                                           letters_to_use=config.letters_to_use,
-                                                           range_=range_words,
-                                                           all_fingerprints=all_fingerprint)
-
-                    all_avg_scores.append(avg_scores)
-                    avg_time_query += avg_query_time
-
-                # update average scores
-                scores_array = np.array(all_avg_scores)
-                final_avg = scores_array.mean(axis=0).tolist()
-                avg_time_query /= config.rounds
-
-                # Average
-                print("algo={},#sources={},dur={},search_func={},num_bests={},ranges={},time_insert={},time_query={},scores={}".format(
-                    config.algo,
-                    num_sources,
-                    config.duration,
-                    config.search_func,
-                    config.num_bests,
-                    str(list(range_words)[0]) + "_" + str(list(range_words)[-1]),
-                    avg_time_insertion,
-                    avg_query_time,
-                    " ".join(["{:.2f}".format(r) for r in final_avg])
-                ))
-
-    # print("Best score is {:.2f}".format(best_score_exp))
+                rows.append({
+                    "algo": config.algo,
+                    "num_sources": num_sources,
+                    "duration": config.duration,
+                    "search_func": (config.msearch_func or config.search_func).__name__,
+                    "num_bests": config.num_bests,
+                    "ranges": str(list(range_words)[0]) + "_" + str(list(range_words)[-1]),
+                    "rounds": []
+                })
+                for _round in range(config.rounds):
+                    jobs.append((len(rows) - 1, config, num_sources, range_words))
+
+    def add_results(results):
+        for job_id, avg_scores, avg_time_insertion, avg_query_time, query_latencies in results:
+            rows[job_id]["rounds"].append((avg_scores, avg_time_insertion, avg_query_time, query_latencies))
+
+    if workers == 1:
+        add_results(map(run_round, jobs))
+    else:
+        workers = workers or cpu_count()
+        index_names = [f"{es_index}_{num_worker}" for num_worker in range(workers)]
+        try:
+            with Manager() as manager:
+                index_queue = manager.Queue()
+                for index_name in index_names:
+                    index_queue.put(index_name)
+                with Pool(processes=workers, initializer=_init_worker, initargs=(index_queue,)) as pool:
+                    add_results(pool.imap_unordered(run_round, jobs))
+        finally:
+            # Indexes of memory_helper are gone with their process, Elasticsearch ones are not
+            if any(config.createindex_func.__module__ == delete_index.__module__ for config in configs):
+                for index_name in index_names:
+                    delete_index(index_name)
+
+    # Average the rounds
+    for row in rows:
+        rounds = row.pop("rounds")
+        row["time_insert"] = float(np.mean([r[1] for r in rounds]))
+        row["time_query"] = float(np.mean([r[2] for r in rounds]))
+        row["scores"] = np.array([r[0] for r in rounds]).mean(axis=0).tolist()
+        all_query_latencies = [r[3] for r in rounds if r[3] is not None]
+        if all_query_latencies:
+            for p in ["p50", "p95", "p99"]:
+                row["query_" + p] = float(np.mean([latencies[p] for latencies in all_query_latencies]))
+
+    return rows
+
+
+def format_row(row):
+    """
+    :param row: A row returned by run_configs
+    :return: The row as one line of text
+    """
+    line = "algo={},#sources={},dur={},search_func={},num_bests={},ranges={},time_insert={},time_query={},scores={}".format(
+        row["algo"],
+        row["num_sources"],
+        row["duration"],
+        row["search_func"],
+        row["num_bests"],
+        row["ranges"],
+        row["time_insert"],
+        row["time_query"],
+        " ".join(["{:.2f}".format(r) for r in row["scores"]])
+    )
+    if "query_p50" in row:
+        line += ",query_p50={},query_p95={},query_p99={}".format(row["query_p50"], row["query_p95"], row["query_p99"])
+
+    return line
+
+
+# Run experiment
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the configurations of configs_to_run")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of rounds run at the same time, each on its own index (default: 1). "
+                             "0 for the number of CPUs. Times are only comparable with 1")
+    parser.add_argument("--output", default=None, help="Optional CSV file to write the results to")
+    args = parser.parse_args()
+
+    rows = run_configs(configs_to_run, workers=args.workers or None)
+    for row in rows:
+        print(format_row(row))
+
+    if args.output:
+        with open(args.output, "w", newline="") as output:
+            columns = list(dict.fromkeys(column for row in rows for column in row))
+            writer = csv.DictWriter(output, fieldnames=columns)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({column: " ".join(str(v) for v in value) if isinstance(value, list) else value
+                                 for column, value in row.items()})
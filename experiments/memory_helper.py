@@ -0,0 +1,289 @@
+"""
+This file contains an in-process alternative to the ES (elasticsearch) functions of es_helper.py.
+
+The fingerprints are shingled the same way (fingerprints_to_words) and stored in an inverted index kept in memory:
+for each word, the list of documents containing it (postings list) is stored as compact integer arrays. Candidates are
+scored with BM25, like ES does by default. No HTTP round trip, no max_clause_count limit.
+
+An approximate alternative, based on MinHash and LSH (see lsh.py), is also available: create_index_lsh,
+store_one_fingerprint_lsh and lsh_search.
+
+The functions at the bottom of this file have the same signatures as their es_helper counterparts (create_index,
+store_one_fingerprint, es_refresh, es_search, ...) and return results shaped like ES results, so they can be given
+as createindex_func, ingest_func, refresh_func and search_func to an experiment Config.
+"""
+
+from array import array
+from collections import Counter
+import time
+
+import numpy as np
+
+from lsh import LSHIndex
+from utils import distance_levenshtein, fingerprints_to_words
+
+
+class ShingleIndex(object):
+    """
+    Inverted index of words (shingles), scored with BM25.
+
+    Postings are appended to growable integer arrays while documents are added. On refresh (done automatically
+    before the first search following an add), they are packed into flat numpy arrays: one array of document ids, one
+    array of precomputed BM25 term weights, and one array of offsets giving the slice of each word.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        """
+        :param k1: BM25 term frequency saturation. Same default as ES
+        :param b: BM25 document length normalization. Same default as ES
+        """
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}  # word -> word id
+        self.documents = []  # _source of each document, indexed by document id
+        self._doc_lengths = array("i")
+        self._postings_docs = []  # For each word id, array of document ids
+        self._postings_tfs = []  # For each word id, array of term frequencies in these documents
+        self._packed = None
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, words, source):
+        """
+        Add a document to the index.
+
+        :param words: The words (shingles) of the document. A word can be repeated
+        :param source: Any dict stored with the document and returned in search results, like {"rdb_id": "1001"}
+        :return: The id of the document
+        """
+        doc_id = len(self.documents)
+        for word, tf in Counter(words).items():
+            word_id = self.vocabulary.get(word)
+            if word_id is None:
+                word_id = len(self.vocabulary)
+                self.vocabulary[word] = word_id
+                self._postings_docs.append(array("i"))
+                self._postings_tfs.append(array("i"))
+            self._postings_docs[word_id].append(doc_id)
+            self._postings_tfs[word_id].append(tf)
+
+        self.documents.append(source)
+        self._doc_lengths.append(len(words))
+        self._packed = None
+
+        return doc_id
+
+    def refresh(self):
+        """
+        Pack the postings lists into flat arrays and precompute the BM25 weight of each posting.
+        """
+        num_docs = len(self.documents)
+        doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.int32).astype(np.float32)
+        avg_length = doc_lengths.mean() if num_docs else 1.
+
+        sizes = np.array([len(p) for p in self._postings_docs], dtype=np.int64)
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+
+        docs = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        for word_id, (word_docs, word_tfs) in enumerate(zip(self._postings_docs, self._postings_tfs)):
+            docs[offsets[word_id]:offsets[word_id + 1]] = word_docs
+            tfs[offsets[word_id]:offsets[word_id + 1]] = word_tfs
+
+        idf = np.log(1 + (num_docs - sizes + .5) / (sizes + .5)).astype(np.float32)
+        norms = self.k1 * (1 - self.b + self.b * doc_lengths[docs] / avg_length)
+        weights = np.repeat(idf, sizes) * tfs * (self.k1 + 1) / (tfs + norms)
+
+        self._packed = (offsets, docs, weights)
+
+    def search(self, words, size=10):
+        """
+        :param words: The words (shingles) of the query. Repeated words weigh more, as in an ES query string
+        :param size: Number of results to return
+        :return: A list of (document id, score), best score first. Documents with no word in common are not returned
+        """
+        if self._packed is None:
+            self.refresh()
+        offsets, docs, weights = self._packed
+
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for word, query_tf in Counter(words).items():
+            word_id = self.vocabulary.get(word)
+            if word_id is None:
+                continue
+            start, end = offsets[word_id], offsets[word_id + 1]
+            # A document appears once in a postings list, so there is no duplicate index here
+            scores[docs[start:end]] += query_tf * weights[start:end]
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > size:
+            candidates = candidates[np.argpartition(-scores[candidates], size - 1)[:size]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in candidates]
+
+    def search_as_es(self, words, size=10):
+        """
+        Same as search, but the result is shaped like an ES search result, so it can be used by
+        es_helper.generic_score_by_es_search.
+        """
+        t1 = time.time()
+        results = self.search(words, size)
+        took = (time.time() - t1) * 1000
+
+        return es_result(self.documents, results, took)
+
+
+def es_result(documents, results, took):
+    """
+    Shape search results like ES search results.
+
+    :param documents: The _source of each document, indexed by document id
+    :param results: A list of (document id, score), best score first
+    :param took: Query time in ms
+    :return: A dict like the result of es.search
+    """
+    hits = [{"_id": str(doc_id), "_score": score, "_source": documents[doc_id]} for doc_id, score in results]
+    return {"took": took, "hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+
+# Index used by the functions below, like es_index is used by the es_helper functions
+memory_index = ShingleIndex()
+memory_shingle_range = range(3, 4)
+
+
+def create_index_memory(lower, higher):
+    """
+    Same as es_helper.create_index: start with an empty index.
+    Words shingled by memory_search_shingle will be from lower to higher letters (like es_helper.create_index_shingle)
+    """
+    global memory_index, memory_shingle_range
+    memory_index = ShingleIndex()
+    memory_shingle_range = range(lower, higher + 1)
+
+
+def store_one_fingerprint_memory(rdb_id, ytb_ids, fingerprint):
+    """
+    Same as es_helper.store_one_fingerprint: fingerprint is a list of words.
+    """
+    memory_index.add(fingerprint, {"rdb_id": rdb_id, "ytb_ids": ytb_ids})
+
+
+def store_one_fingerprint_memory_shingle(rdb_id, ytb_ids, fingerprint):
+    """
+    Same as es_helper.store_one_fingerprint_shingle: fingerprint is the plain fingerprint, shingled here with the
+    range given to create_index_memory.
+    """
+    memory_index.add(fingerprints_to_words(fingerprint, memory_shingle_range), {"rdb_id": rdb_id, "ytb_ids": ytb_ids})
+
+
+def memory_refresh():
+    """
+    Same as es_helper.es_refresh
+    """
+    memory_index.refresh()
+
+
+def memory_search(fingerprint, range_):
+    """
+    Same as es_helper.es_search: convert fingerprint to words (shingles) given the range, and query them.
+
+    :param fingerprint: The fingerprint that will be shingled.
+    :param range_: The min and max word length to use.
+    :return: Results shaped like ES results
+    """
+    return memory_index.search_as_es(fingerprints_to_words(fingerprint, range_))
+
+
+def memory_search_shingle(fingerprint, range_):
+    """
+    Same as es_helper.es_search_shingle: the fingerprint is shingled with the range given to create_index_memory.
+
+    :param fingerprint: The fingerprint
+    :param range_: Unused, but here for genericity
+    :return: Results shaped like ES results
+    """
+    return memory_index.search_as_es(fingerprints_to_words(fingerprint, memory_shingle_range))
+
+
+def memory_msearch(fingerprints, range_):
+    """
+    Same as es_helper.es_msearch: search several fingerprints at once. Each query is timed on its own, in the
+    "took" of its result.
+
+    :return: A list of results shaped like ES results, in the same order as fingerprints
+    """
+    return [memory_search(fingerprint, range_) for fingerprint in fingerprints]
+
+
+def memory_msearch_shingle(fingerprints, range_):
+    """
+    Same as es_helper.es_msearch_shingle: search several fingerprints at once. Each query is timed on its own, in
+    the "took" of its result.
+
+    :return: A list of results shaped like ES results, in the same order as fingerprints
+    """
+    return [memory_search_shingle(fingerprint, range_) for fingerprint in fingerprints]
+
+
+# LSH index used by the functions below. See lsh.LSHIndex for the meaning of bands and rows
+lsh_index = LSHIndex()
+lsh_bands = 64
+lsh_rows = 2
+lsh_shingle_range = range(3, 4)
+
+
+def create_index_lsh(lower, higher):
+    """
+    Same as es_helper.create_index: start with an empty LSH index, of lsh_bands bands of lsh_rows rows.
+    Plain fingerprints stored by store_one_fingerprint_lsh will be shingled from lower to higher letters.
+    """
+    global lsh_index, lsh_shingle_range
+    lsh_index = LSHIndex(bands=lsh_bands, rows=lsh_rows)
+    lsh_shingle_range = range(lower, higher + 1)
+
+
+def store_one_fingerprint_lsh(rdb_id, ytb_ids, fingerprint):
+    """
+    Same as es_helper.store_one_fingerprint: fingerprint is a list of words, or a plain fingerprint (like given by
+    utils_experiments.fingerprint_from_one_random) shingled here with the range given to create_index_lsh.
+    The fingerprint is kept by the index, to re-rank with a distance in lsh_search. Distances of utils.py, like
+    distance_levenshtein, need plain fingerprints.
+    """
+    words = fingerprints_to_words(fingerprint, lsh_shingle_range) if isinstance(fingerprint, str) else fingerprint
+    lsh_index.add(words, {"rdb_id": rdb_id, "ytb_ids": ytb_ids}, fingerprint=fingerprint)
+
+
+def lsh_refresh():
+    """
+    Same as es_helper.es_refresh. Nothing to do, documents are searchable as soon as added.
+    """
+    pass
+
+
+def lsh_search(fingerprint, range_, distance=None):
+    """
+    Same as es_helper.es_search: convert fingerprint to words (shingles) given the range, find candidates sharing an
+    LSH band, and rank them by number of words in common.
+
+    :param fingerprint: The fingerprint that will be shingled.
+    :param range_: The min and max word length to use.
+    :param distance: Optional, a function like utils.distance_levenshtein to rank the candidates with instead, called
+      with fingerprint and the fingerprint stored by store_one_fingerprint_lsh
+    :return: Results shaped like ES results
+    """
+    t1 = time.time()
+    results = lsh_index.search(fingerprints_to_words(fingerprint, range_), fingerprint=fingerprint, distance=distance)
+    took = (time.time() - t1) * 1000
+
+    return es_result(lsh_index.documents, results, took)
+
+
+def lsh_search_levenshtein(fingerprint, range_):
+    """
+    Same as lsh_search, the candidates being ranked by utils.distance_levenshtein. The documents must be stored as plain
+    fingerprints (see store_one_fingerprint_lsh).
+    """
+    return lsh_search(fingerprint, range_, distance=distance_levenshtein)
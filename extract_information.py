@@ -2,18 +2,265 @@
 This file provides function to extract chords or melody from the given file.
 This is basically a wrapper to other libraries.
 Return data in JAMs format, which is different for chords and melody.
+
+Each extract_* function either takes an audio path, or an already decoded audio buffer y and its sample rate sr
+(see load_audio). Giving the buffer allows to decode an audio file once and run several extractors on it.
+Each one also takes an optional tracer (see profiling.py), recording the time spent decoding and extracting.
 """
 
 import librosa
+import soundfile
 import vamp
 import numpy as np
-from crema import analyze as crema_analyze
+import crema
+from crema.models.chord import ChordModel
+import jams
+from profiling import trace
+
+# Sample rate used by default by the extractors to analyze audio
+analysis_sr = 44100
+
+# Resampler used by default to resample the audio to the analysis sample rate. See librosa.resample
+analysis_res_type = "kaiser_best"
+
+# Sample rate and resampler of the algos analyzing audio differently from the defaults above, like
+# {"melody_melodia": {"sr": 22050, "res_type": "polyphase"}}. See use_analysis_settings and
+# experiments/analysis_settings/validate_analysis_settings.py to measure the change of the claraprints
+algo_analysis_settings = {}
+
+# Parameters given to the melodia vamp plugin. See extract_melody_melodia for their meaning
+melodia_parameters = {"minfqr": 100.0, "maxfqr": 1760.0, "voicing": .6, "minpeaksalience": 0.0}
+
+# Version of the output of each extractor, to increase when the code of an extractor changes its output (like the
+# timestamps), so that the outputs already in the extractors cache are not used anymore. See extractor_version
+# melody_melodia 2, melody_piptrack 2: timestamps computed with the hop at the analysis sample rate
+extractor_output_versions = {"chords_chordino": 1, "chords_crema": 1, "melody_melodia": 2, "melody_piptrack": 2}
+
+# Hop of librosa.piptrack, in samples (its default)
+piptrack_hop_length = 512
+
+# Chord model of crema, loaded once by crema_chord_model
+_crema_chord_model = None
+
+
+def stream_audio(audio_path, sr=analysis_sr, block_duration=60., overlap_duration=4., res_type=analysis_res_type,
+                 offset=0., duration=None):
+    """
+    Read an audio file block by block, instead of decoding it whole like load_audio. Only one block is in memory at
+    a time, whatever the duration of the file. Consecutive blocks overlap by overlap_duration seconds.
+    Only the formats read by soundfile (wav, flac, ogg, ...) are supported.
+
+    :param audio_path: The full audio path
+    :param sr: The sample rate to resample each block to
+    :param block_duration: Duration of a block, in seconds
+    :param overlap_duration: Duration shared by two consecutive blocks, in seconds. Must be shorter than block_duration
+    :param res_type: The resampler, see librosa.resample
+    :param offset: Start of the part of the file to read, in seconds
+    :param duration: Duration of the part of the file to read, in seconds. Default is up to the end of the file
+    :return: A generator of (offset of the block in the file in seconds, mono audio buffer of the block at sr)
+    """
+    _check_duration(audio_path, duration)
+
+    info = soundfile.info(audio_path)
+    native_sr = info.samplerate
+    block_size = int(block_duration * native_sr)
+    overlap_size = int(overlap_duration * native_sr)
+    if overlap_size >= block_size:
+        # Blocks would not move forward
+        raise ValueError(f"overlap_duration must be shorter than block_duration, got "
+                         f"overlap_duration={overlap_duration} and block_duration={block_duration}")
+    start = _window_start(audio_path, offset, native_sr, info.frames)
+    stop = None if duration is None else start + int(round(duration * native_sr))
+
+    blocks = soundfile.blocks(audio_path, blocksize=block_size, overlap=overlap_size, dtype="float32", always_2d=True,
+                              start=start, stop=stop)
+    for num_block, block in enumerate(blocks):
+        block_offset = (start + num_block * (block_size - overlap_size)) / native_sr
+        y = block.mean(axis=1)
+        if native_sr != sr:
+            y = librosa.resample(y, native_sr, sr, res_type=res_type)
+        yield block_offset, y
+
+
+def analysis_settings(algo):
+    """
+    :param algo: The algo, like "chords_chordino"
+    :return: A dict with the sample rate ("sr") and the resampler ("res_type") of the audio given to the algo. Can be
+      given as keyword arguments to load_audio
+    """
+    settings = algo_analysis_settings.get(algo, {})
+    return {"sr": settings.get("sr", analysis_sr), "res_type": settings.get("res_type", analysis_res_type)}
+
+
+def use_analysis_settings(algo, sr=None, res_type=None):
+    """
+    Set the sample rate and the resampler of the audio given to the algo, like 22050 Hz with "polyphase" (faster
+    than the default "kaiser_best", see librosa.resample). None to use the default (analysis_sr, analysis_res_type).
+    Decoding and extraction cost about half at 22050 Hz, for a claraprint slightly different: see
+    experiments/analysis_settings/validate_analysis_settings.py to measure it.
+
+    crema resamples its input to the sample rate of its model: a lower sample rate does not make it faster.
+
+    The minimum duration of a melody pitch is kept: its minimum number of frames is scaled to the sample rate (see
+    fingerprint.melody_min_count).
+
+    :param algo: The algo, like "melody_melodia"
+    :param sr: The sample rate
+    :param res_type: The resampler
+    """
+    settings = {}
+    if sr is not None:
+        settings["sr"] = sr
+    if res_type is not None:
+        settings["res_type"] = res_type
+
+    if settings:
+        algo_analysis_settings[algo] = settings
+    else:
+        algo_analysis_settings.pop(algo, None)
+
+
+def extractor_parameters(algo, offset=0., duration=None):
+    """
+    Parameters that change the output of the given extractor. Used to key the extractors cache (see cache.py).
+
+    :param algo: The algo, like "chords_chordino"
+    :param offset: Start of the decoded window, in seconds. See load_audio
+    :param duration: Duration of the decoded window, in seconds. See load_audio
+    :return: A dict of parameters
+    """
+    settings = analysis_settings(algo)
+    parameters = {"sr": settings["sr"]}
+    # Only added for another resampler, so that the keys computed with the default one stay the same
+    if settings["res_type"] != analysis_res_type:
+        parameters["res_type"] = settings["res_type"]
+    if algo == "melody_melodia":
+        parameters.update(melodia_parameters)
+    # Only added for a window, so that the keys of whole files stay the same
+    if offset or duration is not None:
+        parameters.update({"offset": offset, "duration": duration})
+
+    return parameters
+
+
+def extractor_version(algo):
+    """
+    Version of the libraries used by the given extractor, and of its output (see extractor_output_versions). Used to
+    key the extractors cache (see cache.py).
+
+    :param algo: The algo, like "chords_chordino"
+    :return: A version string, like "output=1,librosa=0.7.2"
+    """
+    version = f"output={extractor_output_versions.get(algo, 1)},librosa={librosa.__version__}"
+    if algo == "chords_crema":
+        version += f",crema={getattr(crema, '__version__', '')}"
+    elif algo in ["chords_chordino", "melody_melodia"]:
+        version += f",vamp={getattr(vamp, '__version__', '')}"
+
+    return version
+
+
+def _check_duration(audio_path, duration):
+    """
+    Raises ValueError if a window of duration seconds would be empty. None is up to the end of the file
+    """
+    if duration is not None and duration <= 0:
+        raise ValueError(f"Duration of a window of {audio_path} must be positive, got {duration}s")
+
+
+def _window_start(audio_path, offset, native_sr, frames):
+    """
+    :return: The first frame of a window starting at offset seconds. Raises ValueError if it is not in the file
+    """
+    start = int(round(offset * native_sr))
+    if offset < 0 or start >= frames:
+        raise ValueError(f"Offset {offset}s is out of {audio_path}, lasting {frames / native_sr:.2f}s")
+
+    return start
+
+
+def _read_window(sound_file, sr, offset, duration, res_type):
+    """
+    Read a window of an opened soundfile.SoundFile, seeking directly to its start, as a mono buffer resampled to sr.
+    """
+    native_sr = sound_file.samplerate
+    sound_file.seek(_window_start(sound_file.name, offset, native_sr, sound_file.frames))
+    frames = -1 if duration is None else int(round(duration * native_sr))
+    y = sound_file.read(frames=frames, dtype="float32", always_2d=True).mean(axis=1)
+    if native_sr != sr:
+        y = librosa.resample(y, native_sr, sr, res_type=res_type)
 
+    return y
 
-def extract_chords_chordino(audio_path):
-    audio_1, sr_1 = librosa.load(audio_path, sr=44100, mono=True)
+
+def load_audio(audio_path, sr=analysis_sr, offset=0., duration=None, res_type=analysis_res_type, tracer=None):
+    """
+    Decode and resample the given audio file as a mono buffer. The returned buffer can be given to every extract_*
+    function of this file, so several algorithms run on the same file only pay the decoding once.
+
+    Only the window starting at offset, lasting duration, is decoded and resampled. For the formats read by soundfile
+    (wav, flac, ogg, ...), the file is read from the start of the window directly. Other formats are decoded by
+    librosa, from the start of the file up to the end of the window.
+
+    :param audio_path: The full audio path
+    :param sr: The sample rate to resample the audio to
+    :param offset: Start of the window to decode, in seconds
+    :param duration: Duration of the window to decode, in seconds. Default is up to the end of the file
+    :param res_type: The resampler, see librosa.resample
+    :param tracer: Optional profiling.StageTracer, recording the "decode" stage
+    :return: A tuple (y, sr) with the audio buffer and its sample rate
+    """
+    return load_audio_windows(audio_path, [(offset, duration)], sr=sr, res_type=res_type, tracer=tracer)[0]
+
+
+def load_audio_windows(audio_path, windows, sr=analysis_sr, res_type=analysis_res_type, tracer=None):
+    """
+    Same as load_audio, for several windows of the same file. The file is opened once.
+
+    :param audio_path: The full audio path
+    :param windows: A list of (offset, duration) in seconds, duration being None for up to the end of the file
+    :param sr: The sample rate to resample the audio to
+    :param res_type: The resampler, see librosa.resample
+    :param tracer: Optional profiling.StageTracer, recording the "decode" stage of each window
+    :return: A list of (y, sr), one per window
+    """
+    try:
+        sound_file = soundfile.SoundFile(audio_path)
+    except RuntimeError:
+        # Format not supported by soundfile (like mp3 with older versions of libsndfile)
+        sound_file = None
+
+    buffers = []
+    try:
+        for offset, duration in windows:
+            _check_duration(audio_path, duration)
+            with trace(tracer, "decode") as record:
+                if sound_file is not None:
+                    y = _read_window(sound_file, sr, offset, duration, res_type)
+                else:
+                    y, _sr = librosa.load(audio_path, sr=sr, mono=True, offset=offset, duration=duration,
+                                          res_type=res_type)
+                    if len(y) == 0:
+                        raise ValueError(f"Offset {offset}s is out of {audio_path}")
+                record["audio_duration"] = len(y) / sr
+                record["output_length"] = len(y)
+            buffers.append((y, sr))
+    finally:
+        if sound_file is not None:
+            sound_file.close()
+
+    return buffers
+
+
+def extract_chords_chordino(audio_path=None, y=None, sr=None, tracer=None):
+    if y is None:
+        audio_1, sr_1 = load_audio(audio_path, tracer=tracer, **analysis_settings("chords_chordino"))
+    else:
+        audio_1, sr_1 = y, sr
     duration = librosa.get_duration(audio_1, sr_1)
-    chords = vamp.collect(audio_1, sr_1, "nnls-chroma:chordino")
+    with trace(tracer, "extract", "chords_chordino", duration) as record:
+        chords = vamp.collect(audio_1, sr_1, "nnls-chroma:chordino")
+        record["output_length"] = len(chords['list'])
 
     # Timestamp is of type RealTime. Convert to float first
     chords_casted = {
@@ -58,28 +305,144 @@ def extract_chords_chordino(audio_path):
     return jams_format
 
 
-def extract_chords_crema(audio_path):
-    return crema_analyze.analyze(audio_path)
+def extract_chords_crema(audio_path=None, y=None, sr=None, tracer=None):
+    if y is None:
+        y, sr = load_audio(audio_path, tracer=tracer, **analysis_settings("chords_crema"))
+
+    # Same model as extract_chords_crema_many, instead of the one loaded by crema.analyze
+    with trace(tracer, "extract", "chords_crema", len(y) / sr) as record:
+        jam = _crema_jams(crema_chord_model(), y, sr)
+        record["output_length"] = len(jam.annotations[0].data)
+
+    return jam
+
+
+def crema_chord_model():
+    """
+    :return: The chord model of crema, loaded at the first call
+    """
+    global _crema_chord_model
+    if _crema_chord_model is None:
+        _crema_chord_model = ChordModel()
+
+    return _crema_chord_model
+
+
+def _crema_jams(model, y, sr, outputs=None):
+    """
+    :param model: The chord model of crema, see crema_chord_model
+    :param outputs: The outputs of the model for y, if already computed. Default is to run the model on y
+    :return: The chords of y in JAMS format, like crema.analyze.analyze
+    """
+    jam = jams.JAMS()
+    jam.file_metadata.duration = librosa.get_duration(y=y, sr=sr)
+    jam.annotations.append(model.predict(y=y, sr=sr, outputs=outputs))
+
+    return jam
 
 
-def extract_melody_melodia(audio_path):
-    voicing = .6
+def _crema_buckets(lengths, batch_size, max_padding):
+    """
+    Group inputs of similar lengths, so that little padding is needed to run them as one batch.
 
+    :param lengths: The number of frames of each input
+    :param batch_size: Maximum number of inputs in a group
+    :param max_padding: Maximum padding of an input in a group, as a fraction of the longest input of the group
+    :return: A list of groups, each a list of indexes in lengths
+    """
+    buckets = []
+    for idx in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        bucket = buckets[-1] if buckets else None
+        # Indexes are sorted by decreasing length: the first input of a bucket is the longest
+        if bucket is None or len(bucket) == batch_size or lengths[idx] < (1 - max_padding) * lengths[bucket[0]]:
+            buckets.append([idx])
+        else:
+            bucket.append(idx)
+
+    return buckets
+
+
+def extract_chords_crema_many(audio_paths=None, ys=None, sr=None, batch_size=8, max_padding=.1, tracer=None):
+    """
+    Same as extract_chords_crema, for several recordings at once. The features of all recordings are computed first,
+    then recordings of similar durations are padded to the same length and run through the model as one batch.
+    Running the model once per batch, instead of once per recording, makes better use of the CPU.
+
+    The model is recurrent: the padding at the end of a short recording changes its output a little. max_padding
+    bounds this padding.
+
+    :param audio_paths: The full audio paths. Ignored if ys is given
+    :param ys: The decoded audio buffers, as returned by load_audio
+    :param sr: The sample rate of all buffers of ys
+    :param batch_size: Maximum number of recordings run through the model at once
+    :param max_padding: Maximum padding of a recording, as a fraction of the longest recording of its batch
+    :param tracer: Optional profiling.StageTracer, recording the "decode" and "extract" stages
+    :return: A list of chords in JAMS format, like extract_chords_crema, in the same order as the recordings
+    """
+    if ys is None:
+        ys = []
+        for audio_path in audio_paths:
+            y, sr = load_audio(audio_path, tracer=tracer, **analysis_settings("chords_crema"))
+            ys.append(y)
+
+    model = crema_chord_model()
+    audio_duration = sum(len(y) for y in ys) / sr
+    with trace(tracer, "extract", "chords_crema", audio_duration) as record:
+        features = [model.pump.transform(y=y, sr=sr) for y in ys]
+        # All inputs of the model have the time on axis 1: (batch, time, ...)
+        lengths = [data[model.model.input_names[0]].shape[1] for data in features]
+
+        jams_list = [None] * len(ys)
+        for bucket in _crema_buckets(lengths, batch_size, max_padding):
+            max_length = lengths[bucket[0]]
+            inputs = []
+            for input_name in model.model.input_names:
+                batch = []
+                for idx in bucket:
+                    data = features[idx][input_name]
+                    padding = [(0, 0)] * data.ndim
+                    padding[1] = (0, max_length - data.shape[1])
+                    # Pad with the lowest value of the features, which is silence
+                    batch.append(np.pad(data, padding, mode="constant", constant_values=data.min()))
+                inputs.append(np.concatenate(batch, axis=0))
+
+            predictions = model.model.predict(inputs, batch_size=len(bucket))
+            if len(model.model.output_names) == 1:
+                predictions = [predictions]
+
+            for num_in_bucket, idx in enumerate(bucket):
+                # Same as model.outputs, for this recording only, without the padding
+                outputs = {output_name: predictions[num_output][num_in_bucket, :lengths[idx]]
+                           for num_output, output_name in enumerate(model.model.output_names)}
+
+                jams_list[idx] = _crema_jams(model, ys[idx], sr, outputs)
+
+        record["output_length"] = sum(len(jam.annotations[0].data) for jam in jams_list)
+
+    return jams_list
+
+
+def extract_melody_melodia(audio_path=None, y=None, sr=None, tracer=None):
     # Comments in this function are given by the creator of melodia
     # This is how we load audio using Librosa
-    audio_1, sr_1 = librosa.load(audio_path, sr=44100, mono=True)
+    if y is None:
+        audio_1, sr_1 = load_audio(audio_path, tracer=tracer, **analysis_settings("melody_melodia"))
+    else:
+        audio_1, sr_1 = y, sr
 
     # data_1 = vamp.collect(audio_1, sr_1, "mtg-melodia:melodia")
 
     # vector is a tuple of two values: the hop size used for analysis and the array of pitch values
-    # Note that the hop size is *always* equal to 128/44100.0 = 2.9 ms
+    # Note that the hop size is *always* equal to 128 samples, 128/44100.0 = 2.9 ms at 44100 Hz
     # hop_1, melody_1 = data_1['vector']
 
     # parameter values are specified by providing a dicionary to the optional "parameters" parameter:
-    params = {"minfqr": 100.0, "maxfqr": 1760.0, "voicing": voicing, "minpeaksalience": 0.0}
-
-    data_1 = vamp.collect(audio_1, sr_1, "mtg-melodia:melodia", parameters=params)
-    hop_1, melody_1 = data_1['vector']
+    with trace(tracer, "extract", "melody_melodia", len(audio_1) / sr_1) as record:
+        data_1 = vamp.collect(audio_1, sr_1, "mtg-melodia:melodia", parameters=melodia_parameters)
+        hop_1, melody_1 = data_1['vector']
+        record["output_length"] = len(melody_1)
+    # Hop is of type RealTime. Convert to float first
+    hop_1 = float(hop_1)
 
     # <h3>\*\*\* SUPER IMPORTANT SUPER IMPORTANT \*\*\*</h3>
     # For reasons internal to the vamp architecture, THE TIMESTAMP OF THE FIRST VALUE IN THE MELODY ARRAY IS ALWAYS:
@@ -95,8 +458,9 @@ def extract_melody_melodia(audio_path):
     # ```
     #
     # So, if you want to generate a timestamp array to match the pitch values, you do it like this:
+    # (with the hop returned by the plugin, so that it is right at any sample rate)
 
-    timestamps_1 = 8 * 128 / 44100.0 + np.arange(len(melody_1)) * (128 / 44100.0)
+    timestamps_1 = 8 * hop_1 + np.arange(len(melody_1)) * hop_1
 
     # Melodia has 4 parameters:
     # * **minfqr**: minimum frequency in Hertz (default 55.0)
@@ -121,23 +485,34 @@ def extract_melody_melodia(audio_path):
     return output
 
 
-def extract_melody_piptrack(audio_path):
-    y, sr = librosa.load(audio_path, sr=44100, mono=True)
-    pitches, magnitudes = librosa.core.piptrack(y=y, sr=sr)
+def extract_melody_piptrack(audio_path=None, y=None, sr=None, as_array=False, tracer=None):
+    """
+    :param as_array: If True, return the pitches as a float32 numpy array and the timestamps as a numpy array,
+      instead of lists. Avoids converting every frame to a python float on long recordings.
+    :param tracer: Optional profiling.StageTracer, recording the "decode" and "extract" stages
+    """
+    if y is None:
+        y, sr = load_audio(audio_path, tracer=tracer, **analysis_settings("melody_piptrack"))
+    with trace(tracer, "extract", "melody_piptrack", len(y) / sr) as record:
+        pitches, magnitudes = librosa.core.piptrack(y=y, sr=sr, hop_length=piptrack_hop_length)
 
-    strongest_pitches = []
-    for t in range(1, magnitudes.shape[1]):
-        index = magnitudes[:, t].argmax()
-        pitch = pitches[index, t]
-        strongest_pitches.append(float(pitch))
+        # For each frame (but the first one), the pitch with the strongest magnitude
+        indexes = magnitudes[:, 1:].argmax(axis=0)
+        strongest_pitches = np.take_along_axis(pitches[:, 1:], indexes[np.newaxis, :], axis=0)[0].astype(np.float32)
+        record["output_length"] = len(strongest_pitches)
 
-    timestamps_1 = 8 * 128 / 44100.0 + np.arange(len(strongest_pitches)) * (128 / 44100.0)
+    # Frames are centered: frame i is at i * hop. The first frame is dropped above
+    timestamps_1 = (1 + np.arange(len(strongest_pitches))) * (piptrack_hop_length / sr)
+
+    if not as_array:
+        strongest_pitches = strongest_pitches.tolist()
+        timestamps_1 = timestamps_1.tolist()
 
     output = {
         'data': [
             {
                 'value': strongest_pitches,
-                'time': timestamps_1.tolist()
+                'time': timestamps_1
             }
         ]
     }
@@ -2,6 +2,9 @@ import matplotlib
 
 import matplotlib.pyplot as plt
 import numpy as np
+import json
+import os
+import sys
 
 # Got from experiment es_multiple_fp_generated
 # Config:
@@ -17,6 +20,21 @@ chord_crema_means = [5.22, 4.72]
 melody_melodia_means = [6.52, 11.37]
 melody_piptrack_means = [8.08, 19.70]
 
+# Or read from the output of the benchmark (python -m benchmark --output figures/benchmark.json), given as argument
+benchmark_path = sys.argv[1] if len(sys.argv) > 1 else "benchmark.json"
+if os.path.exists(benchmark_path):
+    benchmark = json.load(open(benchmark_path, "r"))
+    # The figure shows Elasticsearch times: the in-process index is not comparable
+    if benchmark["meta"].get("index") != "es":
+        raise IOError(f"{benchmark_path} was not run on Elasticsearch (index={benchmark['meta'].get('index')}). "
+                      f"Run python -m benchmark --index es")
+    stages = benchmark["stages"]
+    # Times are in seconds in the benchmark, in ms in this figure
+    chord_chordino_means, chord_crema_means, melody_melodia_means, melody_piptrack_means = [
+        [round(stages[f"{stage}_{algo}"]["mean"] * 1000, 2) for stage in ["ingest", "query"]]
+        for algo in ["chords_chordino", "chords_crema", "melody_melodia", "melody_piptrack"]
+    ]
+
 
 # x = np.arange(len(labels))  # the label locations
 x = np.array([0, .5])
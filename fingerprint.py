@@ -1,6 +1,9 @@
 import math
 import re
 import os
+import numpy as np
+
+from profiling import trace
 
 # The scale of all possible pitches returned from chords or melody.
 # Pitches are simplified to sharps (#) only, and no flats (b)
@@ -80,7 +83,7 @@ def get_letters_set_from_algo(algo):
         raise IOError("Unexpected algo type")
 
 
-def clean_chords(data, right_slash=False, resolve_enharmonics=True, time_threshold=100):
+def clean_chords(data, right_slash=False, resolve_enharmonics=True, time_threshold=100, return_times=False):
     """
     From chords_chordino computed by chordino, clean them. Will only use
     letters and # and b by default. Adim becomes A, Ebmaj7 becomes Eb, ...
@@ -97,14 +100,17 @@ def clean_chords(data, right_slash=False, resolve_enharmonics=True, time_thresho
     :param right_slash: (bool) For a chord like 'G7/B', use B.
     :param resolve_enharmonics: (bool) For instance Db becomes C#. Use only #.
     :param time_threshold: (int) Ignore chord if it last less than this value (in ms)
+    :param return_times: (bool) Also return the time of each clean chord
 
     :returns: An array or clean chords, like ["G#", "A#", "B"]. Same repeated chords are reduced to one occurence.
+      If return_times is True, a tuple (clean chords, list of the time of each clean chord in seconds).
     """
 
     enharm_from = ["Ab", "Bb", "Cb", "Db", "Eb", "Fb", "Gb"]
     enharm_to = ["G#", "A#", "B", "C#", "D#", "E", "F#"]
 
     chord_simples = []  # cleaner chord succession
+    chord_times = []  # time of each chord of chord_simples
 
     # Remove duplicated
     chord_num = -1
@@ -146,6 +152,7 @@ def clean_chords(data, right_slash=False, resolve_enharmonics=True, time_thresho
             previous_chord = chord_simples[-1]
         else:
             chord_simples.append(chord_simple)
+            chord_times.append(chord_raw['time'])
             continue
 
         # Skip similar chord to previous one
@@ -153,17 +160,23 @@ def clean_chords(data, right_slash=False, resolve_enharmonics=True, time_thresho
             continue
 
         chord_simples.append(chord_simple)
+        chord_times.append(chord_raw['time'])
+
+    if return_times:
+        return chord_simples, chord_times
 
     return chord_simples
 
 
-def chords_to_prog(chord_simples, letters_to_use):
+def chords_to_intervals(chord_simples, return_indexes=False):
     # Convert progressions in up or down
     chord_prog = []
+    # Index in chord_simples of the chord ending each progression
+    chord_indexes = []
     # Compute fgpt
     previous_chord = ""
     switch_dir = math.floor((len(scale) / 2) + 1)
-    for chord_simple in chord_simples:
+    for chord_num, chord_simple in enumerate(chord_simples):
         # Get position of chord in scale
         idx = scale.index(chord_simple)
         idx_previous = scale.index(previous_chord) if previous_chord != "" else ""
@@ -187,29 +200,137 @@ def chords_to_prog(chord_simples, letters_to_use):
                 new_value = str(len(scale) - diff)
                 prog = "U" + new_value if prog[0] == "D" else "D" + new_value
 
-            letter = letters_to_use[prog]
-            chord_prog.append(letter)
+            chord_prog.append(prog)
+            chord_indexes.append(chord_num)
 
         # Update previous chord
         previous_chord = chord_simple
 
+    if return_indexes:
+        return chord_prog, chord_indexes
+
+    return chord_prog
+
+
+def chords_to_prog(chord_simples, letters_to_use):
     # print("-".join(map(lambda x:x.ljust(2), chord_simples)))
-    claraprint_ = "".join(chord_prog)
+    claraprint_ = "".join([letters_to_use[prog] for prog in chords_to_intervals(chord_simples)])
     return claraprint_
 
 
-def fgpt(chords_clean, letters_set=1):
+def get_letters(letters_set):
+    """
+    :param letters_set: 1, 2 or 3
+    :return: The letters set (letters, letters_set_2 or letters_set_3)
+    """
     if letters_set == 1:
-        letters_to_use = letters
+        return letters
     elif letters_set == 2:
-        letters_to_use = letters_set_2
+        return letters_set_2
     elif letters_set == 3:
-        letters_to_use = letters_set_3
+        return letters_set_3
+    else:
+        raise IOError(f"Letters set {letters_set} not supported")
+
+
+def fgpt(chords_clean, letters_set=1):
+    letters_to_use = get_letters(letters_set)
 
     claraprint_ = chords_to_prog(chords_clean, letters_to_use)
     return claraprint_
 
 
+def fgpt_segments(chords_clean, times, letters_set=1, window=30., hop=15.):
+    """
+    Same as fgpt, but the claraprint is cut into time windows. Each window can be indexed as a separate document,
+    pointing back to the recording, so that a query matching any part of a long recording finds it, and its offset.
+
+    :param chords_clean: Clean chords or melody, as returned by clean_chords or clean_melody
+    :param times: The time of each clean chord or pitch, as returned by clean_chords(return_times=True) or
+      clean_melody(times=...)
+    :param letters_set: See fgpt
+    :param window: Duration of a window, in seconds
+    :param hop: Time between the start of two consecutive windows, in seconds. Windows overlap if hop < window
+    :return: A list of (start time, end time, claraprint of the window). The letter of an interval between two
+      pitches is in a window if the second pitch starts in it. Windows without letters are not returned.
+    """
+    if window <= 0 or hop <= 0:
+        raise ValueError(f"window and hop must be positive, got window={window} and hop={hop}")
+
+    letters_to_use = get_letters(letters_set)
+    progs, indexes = chords_to_intervals(chords_clean, return_indexes=True)
+    if not progs:
+        return []
+
+    claraprint_letters = [letters_to_use[prog] for prog in progs]
+    prog_times = np.asarray(times, dtype=np.float64)[indexes]
+
+    segments = []
+    start = 0.
+    while start <= prog_times[-1]:
+        end = start + window
+        first, last = np.searchsorted(prog_times, [start, end], side="left")
+        if last > first:
+            segments.append((start, end, "".join(claraprint_letters[first:last])))
+        start += hop
+
+    return segments
+
+
+# The 14 intervals of a claraprint. The integer code of an interval is its index in this list
+intervals = list(letters.keys())
+
+
+def fgpt_codes(chords_clean):
+    """
+    Same as fgpt, but the claraprint is returned as integer codes (see intervals) instead of letters.
+    A compact encoding (one byte per interval) that does not depend on a letters set.
+
+    :param chords_clean: Clean chords or melody, as returned by clean_chords or clean_melody
+    :return: A uint8 numpy array
+    """
+    return np.array([intervals.index(prog) for prog in chords_to_intervals(chords_clean)], dtype=np.uint8)
+
+
+def encode_fingerprint(claraprint_, letters_set=1):
+    """
+    Convert a claraprint from letters to integer codes (see intervals).
+    Letters set 3 uses the letter 'y' for two intervals (D7 and U4). It is encoded as D7: two claraprints equal as
+    letters are still equal as codes, and decode_fingerprint returns the same letters.
+
+    :param claraprint_: A claraprint, like "yzyszszryoszszsxqxqs..."
+    :param letters_set: The letters set used by claraprint_. Letters set 2 (3 letters per interval) is not supported
+    :return: A uint8 numpy array
+    """
+    if letters_set == 2:
+        raise IOError("Letters set 2 uses several letters per interval, it cannot be encoded")
+    letters_to_use = get_letters(letters_set)
+
+    # Letter (as ascii code) to interval code. Reversed, so that a letter used twice gets the lowest code
+    unknown = 255
+    lookup = np.full(256, unknown, dtype=np.uint8)
+    for code, interval in reversed(list(enumerate(intervals))):
+        lookup[ord(letters_to_use[interval])] = code
+
+    codes = lookup[np.frombuffer(claraprint_.encode("ascii"), dtype=np.uint8)]
+    if (codes == unknown).any():
+        raise IOError(f"Claraprint contains letters not in letters set {letters_set}")
+
+    return codes
+
+
+def decode_fingerprint(codes, letters_set=1):
+    """
+    Convert a claraprint from integer codes (see intervals) to letters.
+
+    :param codes: A uint8 numpy array, like returned by fgpt_codes or encode_fingerprint
+    :param letters_set: The letters set to use
+    :return: A claraprint, like "yzyszszryoszszsxqxqs..."
+    """
+    letters_to_use = get_letters(letters_set)
+    return "".join([letters_to_use[intervals[code]] for code in codes])
+
+
 # Table taken from https://pages.mtu.edu/~suits/notefreqs.html
 # Note	Frequency (Hz)
 # As we don't discriminate # from b here, only tag notes as # (D# and not Eb)
@@ -361,7 +482,7 @@ def get_note_from_freq(f):
             return prev_note
 
     # Higer than higest
-    return freq
+    return note
 
 
 def note_to_pitch_class(note):
@@ -374,88 +495,662 @@ def note_to_pitch_class(note):
     return re.sub("\d", "", note)
 
 
-def clean_melody(freqs, min_count):
+# scale_freq as arrays, to convert many frequencies at once (see frequencies_to_pitch_classes).
+# scale_freq is sorted by frequency, and each octave has 12 notes starting with C.
+scale_freq_values = np.array(list(scale_freq.values()))
+pitch_classes = [note_to_pitch_class(note) for note in list(scale_freq.keys())[:12]]
+
+
+def frequencies_to_pitch_classes(freqs):
+    """
+    Vectorized equivalent of get_note_from_freq followed by note_to_pitch_class, for a whole array of frequencies.
+    The closest note is found with a binary search in scale_freq_values. When a frequency is exactly between two
+    notes, the lowest is used, as in get_note_from_freq. Frequencies higher than the highest note return the
+    highest note.
+
+    :param freqs: An array of frequencies (float)
+    :return: An array of int, the index of the pitch class of each frequency in pitch_classes
+    """
+    freqs = np.asarray(freqs, dtype=np.float64)
+
+    # Index of the first note higher or equal to the frequency
+    idx = np.minimum(np.searchsorted(scale_freq_values, freqs, side="left"), len(scale_freq_values) - 1)
+    higher = scale_freq_values[idx]
+    lower = scale_freq_values[np.maximum(idx - 1, 0)]
+
+    # Take the previous note when it is at least as close as this one
+    use_lower = (idx > 0) & (freqs != higher) & ~(np.abs(higher - freqs) < np.abs(lower - freqs))
+    idx = idx - use_lower
+
+    return idx % 12
+
+
+def clean_melody(freqs, min_count, times=None):
     """
     Get pitch from each frequence given by melodia. For each frequence, the note will be returned by the function
     get_note_from_freq, and the pitch (no octave information) by note_to_pitch_class.
     Do not repeat twice the same note. If the found melody is ['C', 'C', 'B', 'B'], then ['C', 'B'] will be returned.
 
+    All frames are processed at once with numpy (see frequencies_to_pitch_classes).
+
     :param freqs: The array of frequences to be used
     :param min_count: Do not store pitch if it's not repeated that much time. Some pitched might be artefacts, or
       to fast in the audio to be considered as an interesting melody in our case. Depends on algorithm, for piptrack,
       the value 5 was found optimal, but for melodia, the value 10 was found optimal. Empirical values.
-    :return: An array of clean pitches such as ['C', 'D', 'E', 'C']
+    :param times: Optional, the time of each frequency. If given, the time of each clean pitch is also returned
+    :return: An array of clean pitches such as ['C', 'D', 'E', 'C']. If times is given, a tuple (clean pitches, list
+      of the time of each clean pitch in seconds). The time of a pitch is the time of its first frame.
     """
+    freqs = np.asarray(freqs, dtype=np.float64)
 
     # remove negative values
-    freqs_positive = list(filter(lambda x: x > 0, freqs))
+    freqs_positive = freqs[freqs > 0]
+    if len(freqs_positive) == 0:
+        return ([], []) if times is not None else []
+
+    notes = frequencies_to_pitch_classes(freqs_positive)
+
+    # Split the notes in runs of the same repeated note
+    run_starts = np.concatenate(([0], np.flatnonzero(notes[1:] != notes[:-1]) + 1))
+    run_lengths = np.diff(np.append(run_starts, len(notes)))
 
-    # Keep only values present more than 10 times (included)
-    counter = 0
-    last_val = None
-    notes = []
+    # Keep only runs repeated at least min_count times
+    run_starts = run_starts[run_lengths >= min_count]
+    notes = notes[run_starts]
 
-    for f in freqs_positive:
-        # Add it only if was not the last one already
-        note = note_to_pitch_class(get_note_from_freq(f))
+    # Do not repeat twice the same note. Can happen when a too short run was between two runs of the same note
+    if len(notes) > 0:
+        first_of_note = np.concatenate(([True], notes[1:] != notes[:-1]))
+        notes = notes[first_of_note]
+        run_starts = run_starts[first_of_note]
 
-        if last_val is None or last_val == note:
-            counter += 1
-        elif last_val != note:
-            counter = 1
+    pitches = [pitch_classes[note] for note in notes]
+    if times is not None:
+        times_positive = np.asarray(times, dtype=np.float64)[freqs > 0]
+        return pitches, times_positive[run_starts].tolist()
 
-        if counter >= min_count:
-            if len(notes) == 0 or notes[-1] != note:
-                notes.append(note)
+    return pitches
 
-        last_val = note
 
-    return notes
+# All algos a claraprint can be computed with
+all_algos = ["chords_chordino", "chords_crema", "melody_melodia", "melody_piptrack"]
 
+# For melody algos, minimum number of times a pitch must be repeated to be kept (see clean_melody). These are numbers
+# of frames at 44100 Hz, the sample rate they were found at: see melody_min_count for other sample rates
+melody_min_counts = {
+    "melody_melodia": 10,
+    "melody_piptrack": 5
+}
+
+# For melody algos, duration of a frame at 44100 Hz, in seconds. The hop of melodia is 128 samples, the one of
+# piptrack 512 samples, whatever the sample rate
+melody_frame_durations = {
+    "melody_melodia": 128 / 44100,
+    "melody_piptrack": 512 / 44100
+}
 
-def claraprint(audio_path, algo):
+
+def melody_min_count(algo, frame_duration=None):
     """
-    Compute the claraprint for the given audio path.
-    This function is not very generic, and will do slightly different processes from one algo to the other.
-    The functions used to compute chords or melody are in extract_information.py
+    The min_count to give to clean_melody for the melody of the given algo, see melody_min_counts.
+    At a lower sample rate (see extract_information.use_analysis_settings), frames last longer: at 22050 Hz, a pitch
+    lasts half as many frames. min_count is scaled so that the same minimum duration is kept.
 
-    :param audio_path: The full audio path. Will raise an error if not found
-    :param algo: The algo to be used to compute the claraprint. A value like "chords_chordino", "chords_crema",
-      "melody_piptrack", "melody_melodia", ...
-    :return: A string representing a fingerprint based on the given algo, like "yzyszszryoszszsxqxqs..."
+    :param algo: The melody algo, like "melody_melodia"
+    :param frame_duration: Duration of a frame of the melody, in seconds. Default is the one at 44100 Hz
+    :return: The minimum number of frames
     """
-    if not os.path.exists(audio_path):
-        raise OSError(f"Audio file {audio_path} not found")
+    min_count = melody_min_counts[algo]
+    if frame_duration:
+        min_count = max(1, int(round(min_count * melody_frame_durations[algo] / frame_duration)))
+
+    return min_count
+
+
+def _frame_duration(times):
+    """
+    :param times: The time of each frame of a melody, as returned by extract_pitches
+    :return: The duration of a frame, in seconds. None if there are not enough frames to know it
+    """
+    return times[1] - times[0] if len(times) > 1 else None
+
+
+def extract_pitches(algo, audio_path=None, y=None, sr=None, tracer=None):
+    """
+    Compute the chords or the melody of the given audio, with the given algo. The audio is either given as a path, or
+    as an already decoded buffer y with its sample rate sr.
+    The functions used to compute chords or melody are in extract_information.py
 
-    # Compute chord or melody based on algo
+    :param algo: The algo to be used, like "chords_chordino", "chords_crema", "melody_piptrack", "melody_melodia"
+    :param audio_path: The full audio path. Ignored if y is given
+    :param y: The decoded audio buffer, as returned by extract_information.load_audio
+    :param sr: The sample rate of y
+    :param tracer: Optional profiling.StageTracer, recording the "decode" and "extract" stages
+    :return: The chords or melody in JAMS format. Format differs for chords and melody.
+    """
     if algo == "chords_chordino":
         from extract_information import extract_chords_chordino
-        pitches = extract_chords_chordino(audio_path)
+        return extract_chords_chordino(audio_path, y=y, sr=sr, tracer=tracer)
     elif algo == "chords_crema":
         from extract_information import extract_chords_crema
-        pitches = extract_chords_crema(audio_path)
+        return extract_chords_crema(audio_path, y=y, sr=sr, tracer=tracer)
     elif algo == "melody_melodia":
         from extract_information import extract_melody_melodia
-        pitches = extract_melody_melodia(audio_path)
-        min_count = 10
+        return extract_melody_melodia(audio_path, y=y, sr=sr, tracer=tracer)
     elif algo == "melody_piptrack":
         from extract_information import extract_melody_piptrack
-        pitches = extract_melody_piptrack(audio_path)
-        min_count = 5
+        return extract_melody_piptrack(audio_path, y=y, sr=sr, as_array=True, tracer=tracer)
     else:
         raise IOError(f"Algo {algo} not supported")
 
+
+def clean_pitches(pitches, algo, tracer=None):
+    """
+    Clean the chords or melody computed by extract_pitches, with clean_chords or clean_melody depending on the algo.
+
+    :param pitches: The chords or melody in JAMS format, as returned by extract_pitches
+    :param algo: The algo used to compute the pitches
+    :param tracer: Optional profiling.StageTracer, recording the "clean" stage
+    :return: A tuple (cleaned chords or melody, letters set to give to fgpt)
+    """
     # Depending if algo is chords or melody, do not call the same cleaning method
     algo_type = algo.split("_")[0]
-    if algo_type == "chords":
-        letters_ = 1
-        # in JAMS chords are in ["annotations"][0]["data"]
-        chords_clean = clean_chords(pitches["annotations"][0]["data"], right_slash=False, resolve_enharmonics=True)
-    elif algo_type == "melody":
-        letters_ = 3
-        # in JAMS melody pitches are in ["data"][0]["value"]
-        chords_clean = clean_melody(pitches["data"][0]["value"], min_count=min_count)
+    with trace(tracer, "clean", algo) as record:
+        if algo_type == "chords":
+            letters_ = 1
+            # in JAMS chords are in ["annotations"][0]["data"]
+            chords_clean = clean_chords(pitches["annotations"][0]["data"], right_slash=False, resolve_enharmonics=True)
+        elif algo_type == "melody":
+            letters_ = 3
+            # in JAMS melody pitches are in ["data"][0]["value"]
+            min_count = melody_min_count(algo, _frame_duration(pitches["data"][0]["time"]))
+            chords_clean = clean_melody(pitches["data"][0]["value"], min_count=min_count)
+        else:
+            raise IOError(f"Algo {algo} not supported")
+        record["output_length"] = len(chords_clean)
+
+    return chords_clean, letters_
+
 
-    claraprint_ = fgpt(chords_clean, letters_)
+def claraprint_from_pitches(pitches, algo, tracer=None):
+    """
+    Clean the chords or melody computed by extract_pitches, and convert them to a claraprint.
+
+    :param pitches: The chords or melody in JAMS format, as returned by extract_pitches
+    :param algo: The algo used to compute the pitches
+    :param tracer: Optional profiling.StageTracer, recording the "clean" and "fgpt" stages
+    :return: A string representing a fingerprint based on the given algo, like "yzyszszryoszszsxqxqs..."
+    """
+    chords_clean, letters_ = clean_pitches(pitches, algo, tracer=tracer)
+    with trace(tracer, "fgpt", algo) as record:
+        claraprint_ = fgpt(chords_clean, letters_)
+        record["output_length"] = len(claraprint_)
 
     return claraprint_
+
+
+def claraprint(audio_path, algo, offset=0., duration=None, tracer=None):
+    """
+    Compute the claraprint for the given audio path.
+    This function is not very generic, and will do slightly different processes from one algo to the other.
+    The functions used to compute chords or melody are in extract_information.py
+
+    :param audio_path: The full audio path. Will raise an error if not found
+    :param algo: The algo to be used to compute the claraprint. A value like "chords_chordino", "chords_crema",
+      "melody_piptrack", "melody_melodia", ...
+    :param offset: Start of the window of the audio file to fingerprint, in seconds. Only this window is decoded
+    :param duration: Duration of the window to fingerprint, in seconds, like 30 or 120. Default is up to the end of
+      the file
+    :param tracer: Optional profiling.StageTracer, recording the time and memory of each stage
+    :return: A string representing a fingerprint based on the given algo, like "yzyszszryoszszsxqxqs..."
+    """
+    if not os.path.exists(audio_path):
+        raise OSError(f"Audio file {audio_path} not found")
+
+    if algo not in all_algos:
+        raise IOError(f"Algo {algo} not supported")
+
+    if offset or duration is not None:
+        from extract_information import analysis_settings, load_audio
+        y, sr = load_audio(audio_path, offset=offset, duration=duration, tracer=tracer, **analysis_settings(algo))
+        pitches = extract_pitches(algo, y=y, sr=sr, tracer=tracer)
+    else:
+        pitches = extract_pitches(algo, audio_path, tracer=tracer)
+
+    return claraprint_from_pitches(pitches, algo, tracer=tracer)
+
+
+def _cached_pitches(audio_path, algos, cache, offset=0., duration=None, audio_hash=None):
+    """
+    Check the audio path and the algos, and read the output of the algos on the given window from the cache.
+
+    :param audio_hash: The hash of the audio file, if already computed
+    :return: A tuple (dict of chords or melody found in the cache, indexed by algo, dict of cache keys indexed by algo)
+    """
+    if not os.path.exists(audio_path):
+        raise OSError(f"Audio file {audio_path} not found")
+
+    for algo in algos:
+        if algo not in all_algos:
+            raise IOError(f"Algo {algo} not supported")
+
+    pitches_by_algo = {}
+    keys = {}
+    if cache is not None:
+        from cache import hash_audio_file
+        from extract_information import extractor_parameters, extractor_version
+        if audio_hash is None:
+            audio_hash = hash_audio_file(audio_path)
+        for algo in algos:
+            keys[algo] = cache.key(audio_hash, algo, extractor_parameters(algo, offset, duration),
+                                   extractor_version(algo))
+            pitches = cache.get(keys[algo])
+            if pitches is not None:
+                pitches_by_algo[algo] = pitches
+
+    return pitches_by_algo, keys
+
+
+def _group_by_analysis_settings(algos):
+    """
+    Group the algos analyzing audio at the same sample rate with the same resampler, so that the audio is decoded once
+    per group (see extract_information.analysis_settings).
+
+    :return: A list of (settings, list of algos), settings being keyword arguments of extract_information.load_audio
+    """
+    from extract_information import analysis_settings
+
+    groups = {}
+    for algo in algos:
+        settings = analysis_settings(algo)
+        groups.setdefault((settings["sr"], settings["res_type"]), (settings, []))[1].append(algo)
+
+    return list(groups.values())
+
+
+def _extract_missing_pitches(pitches_by_algo, keys, algos, y, sr, cache, tracer):
+    """
+    Run the algos missing from pitches_by_algo on the decoded buffer, and put their output in the cache.
+    """
+    for algo in algos:
+        if algo in pitches_by_algo:
+            continue
+        pitches = extract_pitches(algo, y=y, sr=sr, tracer=tracer)
+        if cache is not None:
+            cache.put(keys[algo], pitches)
+        pitches_by_algo[algo] = pitches
+
+
+def extract_all_pitches(audio_path, algos=all_algos, cache=None, offset=0., duration=None, tracer=None):
+    """
+    Compute the chords or melody of several algos for the given audio path. The audio file is decoded and resampled
+    once, and the same buffer is given to every algo. Algos set to analyze audio at another sample rate or with
+    another resampler (see extract_information.use_analysis_settings) get their own decoding.
+
+    If a cache is given, the output of each algo is read from the cache when available, and the audio is only decoded
+    if at least one algo is missing from the cache. Useful to recompute claraprints with other cleaning parameters
+    (see claraprint_from_pitches, clean_chords, clean_melody) without running the extractors again.
+
+    :param audio_path: The full audio path. Will raise an error if not found
+    :param algos: The algos to be used. See all_algos
+    :param cache: An optional cache.ExtractionCache
+    :param offset: Start of the window to decode, in seconds
+    :param duration: Duration of the window to decode, in seconds. Default is up to the end of the file
+    :param tracer: Optional profiling.StageTracer, recording the "decode" and "extract" stages
+    :return: A dict of chords or melody in JAMS format, indexed by algo
+    """
+    pitches_by_algo, keys = _cached_pitches(audio_path, algos, cache, offset, duration)
+
+    missing_algos = [algo for algo in algos if algo not in pitches_by_algo]
+    if missing_algos:
+        from extract_information import load_audio
+        for settings, settings_algos in _group_by_analysis_settings(missing_algos):
+            y, sr = load_audio(audio_path, offset=offset, duration=duration, tracer=tracer, **settings)
+            _extract_missing_pitches(pitches_by_algo, keys, settings_algos, y, sr, cache, tracer)
+
+    return pitches_by_algo
+
+
+def claraprints(audio_path, algos=all_algos, cache=None, offset=0., duration=None, tracer=None):
+    """
+    Compute the claraprints of several algos for the given audio path. The audio file is decoded and resampled once,
+    and the same buffer is given to every algo. Computing the 4 claraprints of a recording costs one decoding
+    instead of four.
+
+    :param audio_path: The full audio path. Will raise an error if not found
+    :param algos: The algos to be used to compute the claraprints. See all_algos
+    :param cache: An optional cache.ExtractionCache storing the output of the extractors, see extract_all_pitches
+    :param offset: Start of the window to fingerprint, in seconds. Only this window is decoded
+    :param duration: Duration of the window to fingerprint, in seconds. Default is up to the end of the file
+    :param tracer: Optional profiling.StageTracer, recording the time and memory of each stage
+    :return: A dict of claraprints indexed by algo, like {"chords_chordino": "hjkhab...", "melody_melodia": "yzys..."}
+    """
+    pitches_by_algo = extract_all_pitches(audio_path, algos, cache=cache, offset=offset, duration=duration,
+                                          tracer=tracer)
+
+    return {algo: claraprint_from_pitches(pitches_by_algo[algo], algo, tracer=tracer) for algo in algos}
+
+
+def claraprints_windows(audio_path, windows, algos=all_algos, cache=None, tracer=None):
+    """
+    Compute the claraprints of several windows of the same audio file, like its first 30 and 120 seconds. The file is
+    opened once, and only the windows are decoded.
+
+    :param audio_path: The full audio path. Will raise an error if not found
+    :param windows: A list of (offset, duration) in seconds, like [(0, 30), (0, 120)]. See claraprints
+    :param algos: The algos to be used to compute the claraprints. See all_algos
+    :param cache: An optional cache.ExtractionCache storing the output of the extractors, see extract_all_pitches
+    :param tracer: Optional profiling.StageTracer, recording the time and memory of each stage
+    :return: A list of dict of claraprints indexed by algo, one per window
+    """
+    audio_hash = None
+    if cache is not None and os.path.exists(audio_path):
+        from cache import hash_audio_file
+        audio_hash = hash_audio_file(audio_path)
+
+    cached = [_cached_pitches(audio_path, algos, cache, offset, duration, audio_hash) for offset, duration in windows]
+
+    from extract_information import load_audio_windows
+    for settings, settings_algos in _group_by_analysis_settings(algos):
+        missing = [num_window for num_window, (pitches_by_algo, _keys) in enumerate(cached)
+                   if any(algo not in pitches_by_algo for algo in settings_algos)]
+        if not missing:
+            continue
+        buffers = load_audio_windows(audio_path, [windows[num_window] for num_window in missing], tracer=tracer,
+                                     **settings)
+        for num_window, (y, sr) in zip(missing, buffers):
+            pitches_by_algo, keys = cached[num_window]
+            _extract_missing_pitches(pitches_by_algo, keys, settings_algos, y, sr, cache, tracer)
+
+    return [{algo: claraprint_from_pitches(pitches_by_algo[algo], algo, tracer=tracer) for algo in algos}
+            for pitches_by_algo, _keys in cached]
+
+
+def extract_all_pitches_many(audio_paths, algos=all_algos, cache=None, offset=0., duration=None, batch_size=8,
+                             return_errors=False, tracer=None):
+    """
+    Same as extract_all_pitches, for several audio paths. chords_crema runs on batch_size recordings at once (see
+    extract_information.extract_chords_crema_many), the other algos on one recording at a time.
+    At most batch_size decoded recordings are held in memory.
+
+    :param audio_paths: The full audio paths. Will raise an error if one is not found
+    :param algos: The algos to be used. See all_algos
+    :param cache: An optional cache.ExtractionCache
+    :param offset: Start of the window of each recording to decode, in seconds
+    :param duration: Duration of the window of each recording to decode, in seconds. Default is up to the end of the
+      recording
+    :param batch_size: Number of recordings run through the crema model at once
+    :param return_errors: If True, a recording in error does not stop the others: its exception is returned in place
+      of its dict. Otherwise, the first error is raised
+    :param tracer: Optional profiling.StageTracer, recording the "decode" and "extract" stages
+    :return: A list of dict of chords or melody in JAMS format indexed by algo, in the same order as audio_paths
+    """
+    from extract_information import load_audio, extract_chords_crema_many
+
+    results = []
+    for first in range(0, len(audio_paths), batch_size):
+        batch_results = []
+        batch_keys = []
+        crema_indexes = []  # Indexes in the batch of the recordings to run crema on
+        crema_ys = []
+        crema_sr = None
+        for audio_path in audio_paths[first:first + batch_size]:
+            idx = len(batch_results)
+            batch_results.append(None)
+            batch_keys.append(None)
+            try:
+                pitches_by_algo, keys = _cached_pitches(audio_path, algos, cache, offset, duration)
+                batch_results[idx] = pitches_by_algo
+                batch_keys[idx] = keys
+
+                missing_algos = [algo for algo in algos if algo not in pitches_by_algo]
+                for settings, settings_algos in _group_by_analysis_settings(missing_algos):
+                    y, sr = load_audio(audio_path, offset=offset, duration=duration, tracer=tracer, **settings)
+
+                    for algo in settings_algos:
+                        if algo == "chords_crema":
+                            crema_indexes.append(idx)
+                            crema_ys.append(y)
+                            crema_sr = sr
+                            continue
+                        pitches = extract_pitches(algo, y=y, sr=sr, tracer=tracer)
+                        if cache is not None:
+                            cache.put(keys[algo], pitches)
+                        pitches_by_algo[algo] = pitches
+            except Exception as e:
+                if not return_errors:
+                    raise
+                batch_results[idx] = e
+
+        if crema_ys:
+            try:
+                crema_results = extract_chords_crema_many(ys=crema_ys, sr=crema_sr, batch_size=batch_size,
+                                                          tracer=tracer)
+            except Exception:
+                if not return_errors:
+                    raise
+                # Run the recordings one by one, to only report the ones in error
+                crema_results = []
+                for y in crema_ys:
+                    try:
+                        crema_results.extend(extract_chords_crema_many(ys=[y], sr=crema_sr, tracer=tracer))
+                    except Exception as e:
+                        crema_results.append(e)
+
+            for idx, pitches in zip(crema_indexes, crema_results):
+                if isinstance(batch_results[idx], Exception):
+                    continue
+                if isinstance(pitches, Exception):
+                    batch_results[idx] = pitches
+                    continue
+                if cache is not None:
+                    cache.put(batch_keys[idx]["chords_crema"], pitches)
+                batch_results[idx]["chords_crema"] = pitches
+
+        results.extend(batch_results)
+
+    return results
+
+
+def claraprints_many(audio_paths, algos=all_algos, cache=None, offset=0., duration=None, batch_size=8,
+                     return_errors=False, tracer=None):
+    """
+    Same as claraprints, for several audio paths. See extract_all_pitches_many.
+
+    :return: A list of dict of claraprints indexed by algo, in the same order as audio_paths. With return_errors, the
+      exception of a recording in error is in place of its dict
+    """
+    pitches_many = extract_all_pitches_many(audio_paths, algos, cache=cache, offset=offset, duration=duration,
+                                            batch_size=batch_size, return_errors=return_errors, tracer=tracer)
+
+    results = []
+    for pitches_by_algo in pitches_many:
+        if isinstance(pitches_by_algo, Exception):
+            results.append(pitches_by_algo)
+            continue
+        try:
+            results.append({algo: claraprint_from_pitches(pitches_by_algo[algo], algo, tracer=tracer)
+                            for algo in algos})
+        except Exception as e:
+            if not return_errors:
+                raise
+            results.append(e)
+
+    return results
+
+
+def claraprint_segments(audio_path, algo, window=30., hop=15.):
+    """
+    Compute the claraprint of the given audio path, cut into time windows. See fgpt_segments.
+
+    :param audio_path: The full audio path. Will raise an error if not found
+    :param algo: The algo to be used, see all_algos
+    :param window: Duration of a window, in seconds
+    :param hop: Time between the start of two consecutive windows, in seconds
+    :return: A list of (start time, end time, claraprint of the window)
+    """
+    if not os.path.exists(audio_path):
+        raise OSError(f"Audio file {audio_path} not found")
+
+    if algo not in all_algos:
+        raise IOError(f"Algo {algo} not supported")
+
+    pitches = extract_pitches(algo, audio_path)
+
+    algo_type = algo.split("_")[0]
+    if algo_type == "chords":
+        chords_clean, times = clean_chords(pitches["annotations"][0]["data"], right_slash=False,
+                                           resolve_enharmonics=True, return_times=True)
+    else:
+        min_count = melody_min_count(algo, _frame_duration(pitches["data"][0]["time"]))
+        chords_clean, times = clean_melody(pitches["data"][0]["value"], min_count=min_count,
+                                           times=pitches["data"][0]["time"])
+
+    return fgpt_segments(chords_clean, times, get_letters_set_from_algo(algo), window=window, hop=hop)
+
+
+class IncrementalChords(object):
+    """
+    Clean chords (see clean_chords) given window by window, with the same result as cleaning them all at once.
+    The last chord of a window is kept until the next window, as its duration is only known then.
+    """
+
+    def __init__(self):
+        self.pending = None  # Last chord of the previous window, not cleaned yet
+        self.last = None  # Last clean chord returned
+
+    def feed(self, data, is_last):
+        """
+        :param data: The chords of the window, JAMS like in clean_chords, with times from the start of the file
+        :param is_last: True for the last window
+        :return: The new clean chords
+        """
+        data = ([self.pending] if self.pending is not None else []) + list(data)
+        self.pending = None
+        if not is_last and data:
+            self.pending = data[-1]
+            # The pending chord is replaced by an unknown chord, which gives its time to the previous chord
+            data = data[:-1] + [{"time": self.pending["time"], "value": "N"}]
+
+        chords = clean_chords(data, right_slash=False, resolve_enharmonics=True)
+        if chords and chords[0] == self.last:
+            chords = chords[1:]
+        if chords:
+            self.last = chords[-1]
+
+        return chords
+
+
+class IncrementalMelody(object):
+    """
+    Clean a melody (see clean_melody) given window by window, with the same result as cleaning it all at once.
+    The frames of the last note of a window are kept until the next window, as the note can go on in it.
+    """
+
+    def __init__(self, min_count):
+        """
+        :param min_count: See clean_melody
+        """
+        self.min_count = min_count
+        self.tail = np.empty(0)  # Positive frequencies of the last note of the previous window, not cleaned yet
+        self.last = None  # Last clean pitch returned
+
+    def feed(self, freqs, is_last):
+        """
+        :param freqs: The frequencies of the window
+        :param is_last: True for the last window
+        :return: The new clean pitches
+        """
+        freqs = np.asarray(freqs, dtype=np.float64)
+        freqs = np.concatenate((self.tail, freqs[freqs > 0]))
+        self.tail = np.empty(0)
+        if not is_last and len(freqs) > 0:
+            notes = frequencies_to_pitch_classes(freqs)
+            changes = np.flatnonzero(notes[1:] != notes[:-1])
+            last_note_start = changes[-1] + 1 if len(changes) > 0 else 0
+            self.tail = freqs[last_note_start:]
+            freqs = freqs[:last_note_start]
+
+        pitches = clean_melody(freqs, self.min_count)
+        if pitches and pitches[0] == self.last:
+            pitches = pitches[1:]
+        if pitches:
+            self.last = pitches[-1]
+
+        return pitches
+
+
+def claraprint_stream(audio_path, algo, block_duration=60., overlap_duration=4., offset=0., duration=None):
+    """
+    Compute the claraprint of a long audio file window by window, with a fixed memory whatever its duration.
+    The audio is read block by block (see extract_information.stream_audio), chords or melody are extracted for each
+    block, and are cleaned and converted to claraprint incrementally.
+
+    Two consecutive windows overlap by overlap_duration seconds, so that the extractors do not miss what happens at
+    the limit between two windows. In this overlap, the first half is taken from the first window, the second half
+    from the second window.
+
+    Concatenating all segments gives the claraprint of the file. It can differ slightly from claraprint(audio_path,
+    algo), as the extractors do not see the whole file at once.
+
+    :param audio_path: The full audio path. Will raise an error if not found. Must be readable by soundfile
+    :param algo: The algo to be used, see all_algos
+    :param block_duration: Duration of a window, in seconds
+    :param overlap_duration: Duration shared by two consecutive windows, in seconds
+    :param offset: Start of the part of the file to fingerprint, in seconds
+    :param duration: Duration of the part of the file to fingerprint, in seconds. Default is up to the end of the file
+    :return: A generator of claraprint segments (str), one per window. A segment can be empty
+    """
+    if not os.path.exists(audio_path):
+        raise OSError(f"Audio file {audio_path} not found")
+
+    if algo not in all_algos:
+        raise IOError(f"Algo {algo} not supported")
+
+    from extract_information import stream_audio, analysis_settings
+
+    settings = analysis_settings(algo)
+    algo_type = algo.split("_")[0]
+    letters_to_use = get_letters(get_letters_set_from_algo(algo))
+    if algo_type == "chords":
+        cleaner = IncrementalChords()
+    else:
+        cleaner = IncrementalMelody(melody_min_count(algo, melody_frame_durations[algo] * 44100 / settings["sr"]))
+
+    def with_is_last(blocks):
+        # Look one block ahead, to know which block is the last one
+        previous = None
+        for block in blocks:
+            if previous is not None:
+                yield previous + (False,)
+            previous = block
+        if previous is not None:
+            yield previous + (True,)
+
+    previous_pitch = None
+    blocks = stream_audio(audio_path, block_duration=block_duration, overlap_duration=overlap_duration, offset=offset,
+                          duration=duration, **settings)
+    for num_block, (block_offset, y, is_last) in enumerate(with_is_last(blocks)):
+        pitches = extract_pitches(algo, y=y, sr=settings["sr"])
+
+        # Part of the window kept, see overlap above
+        keep_start = block_offset + overlap_duration / 2 if num_block > 0 else -math.inf
+        keep_end = block_offset + block_duration - overlap_duration / 2 if not is_last else math.inf
+
+        if algo_type == "chords":
+            data = [{"time": chord["time"] + block_offset, "value": chord["value"]}
+                    for chord in pitches["annotations"][0]["data"]]
+            new_pitches = cleaner.feed([c for c in data if keep_start <= c["time"] < keep_end], is_last)
+        else:
+            times = np.asarray(pitches["data"][0]["time"]) + block_offset
+            freqs = np.asarray(pitches["data"][0]["value"])
+            new_pitches = cleaner.feed(freqs[(keep_start <= times) & (times < keep_end)], is_last)
+
+        # The interval between the last pitch of the previous window and the first one of this window belongs to
+        # this segment
+        if previous_pitch is not None:
+            new_pitches = [previous_pitch] + new_pitches
+        if new_pitches:
+            previous_pitch = new_pitches[-1]
+
+        yield chords_to_prog(new_pitches, letters_to_use)
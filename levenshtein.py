@@ -0,0 +1,100 @@
+"""
+Levenshtein distance with a cutoff, and a batched API comparing one query to many fingerprints.
+
+The distance is computed with the bit-vector algorithm of Myers (1999), in the edit distance form given by Hyyrö
+(2001). A column of the dynamic programming matrix is held in two integers (bits set where the value goes up or down
+from one row to the next), and the whole column is updated at once with a few bitwise operations. A claraprint
+uses 14 letters, so the bit mask of each letter in the query is computed once and reused for every text.
+
+With a cutoff (max_distance), the computation stops as soon as the distance is known to be over the cutoff:
+when the lengths differ by more than the cutoff (the band of diagonals |i - j| <= max_distance cannot reach the last
+cell), or when the last row, minus the number of letters left, is already over the cutoff. This keeps the exact
+re-ranking of hundreds of candidates cheap, as most of them are far from the query.
+"""
+
+
+def pattern_masks(pattern):
+    """
+    :param pattern: The query
+    :return: A dict letter -> integer with bit i set if pattern[i] is this letter
+    """
+    masks = {}
+    for i, letter in enumerate(pattern):
+        masks[letter] = masks.get(letter, 0) | (1 << i)
+
+    return masks
+
+
+def _distance(masks, m, text, max_distance):
+    n = len(text)
+    if max_distance is not None and abs(m - n) > max_distance:
+        return max_distance + 1
+    if m == 0:
+        return n
+
+    all_ones = (1 << m) - 1
+    last_bit = 1 << (m - 1)
+    pv = all_ones  # vertical deltas of +1
+    mv = 0  # vertical deltas of -1
+    score = m  # value of the last row, D[m][0]
+
+    for j, letter in enumerate(text):
+        eq = masks.get(letter, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & all_ones)  # horizontal deltas of +1
+        mh = pv & xh  # horizontal deltas of -1
+
+        if ph & last_bit:
+            score += 1
+        elif mh & last_bit:
+            score -= 1
+
+        # The first row is D[0][j] = j, so its horizontal delta is always +1
+        ph = ((ph << 1) | 1) & all_ones
+        mh = (mh << 1) & all_ones
+        pv = mh | (~(xv | ph) & all_ones)
+        mv = ph & xv
+
+        # The last row can decrease by at most 1 per letter left
+        if max_distance is not None and score - (n - j - 1) > max_distance:
+            return max_distance + 1
+
+    return score
+
+
+def levenshtein_distance(text_1, text_2, max_distance=None):
+    """
+    :param text_1: Fingerprint 1 to compare
+    :param text_2: Fingerprint 2 to compare
+    :param max_distance: Optional cutoff. If the distance is over it, stop early and return max_distance + 1
+    :return: The Levenshtein distance, or max_distance + 1 if over the cutoff
+    """
+    return _distance(pattern_masks(text_1), len(text_1), text_2, max_distance)
+
+
+def levenshtein_many(query, texts, max_distance=None):
+    """
+    Levenshtein distance of one query to many fingerprints. The bit masks of the query are computed once.
+
+    :param query: The fingerprint to compare to all others
+    :param texts: The fingerprints to compare to
+    :param max_distance: Optional cutoff, see levenshtein_distance
+    :return: A list of distances, in the same order as texts
+    """
+    masks = pattern_masks(query)
+    return [_distance(masks, len(query), text, max_distance) for text in texts]
+
+
+def distance_levenshtein_many(query, texts, max_distance=None):
+    """
+    Same as utils.distance_levenshtein (highest score is the best match) for one query and many fingerprints.
+
+    :param query: The fingerprint to compare to all others
+    :param texts: The fingerprints to compare to
+    :param max_distance: Optional cutoff, see levenshtein_distance. The score of a fingerprint over the cutoff is
+      computed with max_distance + 1, so it is lower than the score of all fingerprints under the cutoff
+    :return: A list of scores, in the same order as texts
+    """
+    distances = levenshtein_many(query, texts, max_distance)
+    return [max(len(query), len(text)) - distance for text, distance in zip(texts, distances)]
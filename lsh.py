@@ -0,0 +1,183 @@
+"""
+MinHash signatures and LSH (locality sensitive hashing) index over claraprint shingles.
+
+The MinHash signature of a set of words (see utils.fingerprints_to_words) is a short array of integers. Two sets
+share the value at a given position with a probability equal to their Jaccard similarity. Instead of words, the
+integer hashes of utils.shingle_hashes can be given, which skips hashing the words one by one. Signatures of words and
+of hashes are not comparable: an index must be built and queried with the same one.
+
+The LSH index cuts each signature in bands of rows values. Two fingerprints sharing one band (all rows equal) are
+candidates. Only candidates are scored exactly (common words, like utils.distance_commonwords, or any distance of
+utils.py like distance_levenshtein), so a lookup does not compare the query to the whole catalogue.
+
+With b bands of r rows, a pair of Jaccard similarity s is a candidate with probability 1 - (1 - s^r)^b.
+The similarity where this probability rises sharply is about (1 / b)^(1 / r).
+"""
+
+import zlib
+
+import numpy as np
+
+
+def word_hashes(words):
+    """
+    Hash words to 32 bits integers. Stable from one process to the other, contrary to python's hash.
+
+    :param words: A list of words, or a numpy array of integer hashes (see utils.shingle_hashes), returned as is
+    :return: A uint64 numpy array of hashes
+    """
+    if isinstance(words, np.ndarray):
+        return words.astype(np.uint64, copy=False)
+
+    return np.fromiter((zlib.crc32(word.encode("utf-8")) for word in words), dtype=np.uint64, count=len(words))
+
+
+def minhash_permutations(num_perm, seed=1):
+    """
+    Parameters of the num_perm hash functions used for MinHash. Each function is a multiply-shift hash:
+    h(x) = ((a * x + b) mod 2^64) >> 32, with a odd.
+
+    :param num_perm: Number of hash functions, which is the length of the signatures
+    :param seed: Signatures are only comparable if computed with the same seed
+    :return: A tuple (a, b) of uint64 arrays of length num_perm
+    """
+    rng = np.random.RandomState(seed)
+    a = rng.randint(0, 2 ** 32, size=(num_perm, 2)).astype(np.uint64)
+    b = rng.randint(0, 2 ** 32, size=(num_perm, 2)).astype(np.uint64)
+    a = (a[:, 0] << np.uint64(32)) | a[:, 1] | np.uint64(1)
+    b = (b[:, 0] << np.uint64(32)) | b[:, 1]
+
+    return a, b
+
+
+def minhash_signature(words, num_perm=128, seed=1, permutations=None):
+    """
+    Compute the MinHash signature of a set of words.
+
+    :param words: A list of words, like returned by utils.fingerprints_to_words, or the hashes returned by
+      utils.shingle_hashes. Repeated words do not count
+    :param num_perm: Length of the signature
+    :param seed: See minhash_permutations
+    :param permutations: Optional, the result of minhash_permutations, to avoid computing it for each signature
+    :return: A uint32 numpy array of length num_perm
+    """
+    if permutations is None:
+        permutations = minhash_permutations(num_perm, seed)
+    a, b = permutations
+
+    if len(words) == 0:
+        return np.full(len(a), np.iinfo(np.uint32).max, dtype=np.uint32)
+
+    hashes = word_hashes(words)
+    # uint64 overflow is intended: it is the mod 2^64 of the hash function
+    permuted = (hashes[:, np.newaxis] * a[np.newaxis, :] + b[np.newaxis, :]) >> np.uint64(32)
+
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def _word_set(words):
+    """
+    :param words: A list of words, or a numpy array of hashes
+    :return: The words as a frozenset, for re-ranking by number of words in common
+    """
+    if isinstance(words, np.ndarray):
+        # Python ints hash and compare faster than numpy scalars
+        return frozenset(words.tolist())
+
+    return frozenset(words)
+
+
+class LSHIndex(object):
+    """
+    LSH index of MinHash signatures, with exact re-ranking of the candidates.
+
+    Usage:
+
+        index = LSHIndex(bands=64, rows=2)
+        index.add(fingerprints_to_words(fingerprint, range(2, 8)), {"rdb_id": "1001"}, fingerprint=fingerprint)
+        index.search(fingerprints_to_words(query, range(2, 8)))
+        index.search(fingerprints_to_words(query, range(2, 8)), fingerprint=query, distance=distance_levenshtein)
+
+    Words can also be given as the hashes of utils.shingle_hashes, for all documents and queries of the index:
+
+        index.add(shingle_hashes(encode_fingerprint(fingerprint), range(2, 8)), {"rdb_id": "1001"})
+    """
+
+    def __init__(self, bands=64, rows=2, seed=1):
+        """
+        :param bands: Number of bands. More bands find more candidates
+        :param rows: Number of values of the signature in each band. More rows find less, but more similar, candidates
+        :param seed: See minhash_permutations
+        """
+        self.bands = bands
+        self.rows = rows
+        self.permutations = minhash_permutations(bands * rows, seed)
+        self.documents = []  # source of each document, indexed by document id
+        self.fingerprints = []  # plain fingerprint of each document, if given
+        self._words = []  # set of words of each document, for re-ranking
+        self._buckets = [{} for _ in range(bands)]  # For each band, band value -> list of document ids
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _band_keys(self, words):
+        signature = minhash_signature(words, permutations=self.permutations)
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, words, source, fingerprint=None):
+        """
+        Add a document to the index.
+
+        :param words: The words (shingles) of the document
+        :param source: Any dict stored with the document and returned in search results, like {"rdb_id": "1001"}
+        :param fingerprint: Optional plain fingerprint, needed to re-rank with a distance working on plain fingerprints
+        :return: The id of the document
+        """
+        doc_id = len(self.documents)
+        for band, key in enumerate(self._band_keys(words)):
+            self._buckets[band].setdefault(key, []).append(doc_id)
+
+        self.documents.append(source)
+        self.fingerprints.append(fingerprint)
+        self._words.append(_word_set(words))
+
+        return doc_id
+
+    def candidates(self, words):
+        """
+        :param words: The words (shingles) of the query
+        :return: The set of ids of the documents sharing at least one band with the query
+        """
+        candidates = set()
+        for band, key in enumerate(self._band_keys(words)):
+            candidates.update(self._buckets[band].get(key, ()))
+
+        return candidates
+
+    def search(self, words, size=10, fingerprint=None, distance=None):
+        """
+        Find the candidates of the query, and rank them by exact score.
+
+        :param words: The words (shingles) of the query
+        :param size: Number of results to return
+        :param fingerprint: The plain fingerprint of the query. Needed if distance is given
+        :param distance: Optional, a function like utils.distance_levenshtein, called with the plain fingerprints of
+          the query and the candidate. Highest score is the best match. By default, candidates are ranked by number of
+          words in common with the query, like utils.distance_commonwords.
+        :return: A list of (document id, score), best score first
+        """
+        if distance is not None and fingerprint is None:
+            raise IOError("The plain fingerprint of the query is needed to re-rank with a distance")
+
+        query_words = _word_set(words)
+        results = []
+        for doc_id in self.candidates(words):
+            if distance is None:
+                score = len(query_words & self._words[doc_id])
+            else:
+                score = distance(fingerprint, self.fingerprints[doc_id])
+            results.append((doc_id, score))
+
+        results.sort(key=lambda result: (-result[1], result[0]))
+
+        return results[:size]
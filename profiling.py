@@ -0,0 +1,169 @@
+"""
+Opt-in instrumentation of the claraprint pipeline.
+
+Give a StageTracer to claraprint, claraprints, extract_all_pitches (fingerprint.py) or to the functions of
+extract_information.py, as tracer. Each stage (decode, extract, clean, fgpt) is then recorded with:
+- wall_time and cpu_time, in seconds;
+- peak_rss_increase, how much the stage raised the peak resident memory of the process, in bytes. 0 if the stage
+  stayed below a peak reached before it (None if not available);
+- process_peak_rss, the peak resident memory of the process since it started, at the end of the stage, in bytes
+  (None if not available). It is not specific to the stage: all the stages after the largest one report its peak;
+- audio_duration, the duration of the audio processed by the stage, in seconds, when known;
+- output_length, the number of values output by the stage (chords, melody frames, letters of the claraprint).
+
+Usage:
+
+    tracer = StageTracer()
+    claraprints(audio_path, tracer=tracer)
+    print(tracer.to_prometheus())
+    json.dump(tracer.to_json(), open("trace.json", "w"))
+
+Without a tracer (default), the stages are not measured.
+"""
+
+from contextlib import contextmanager, nullcontext
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def peak_rss():
+    """
+    :return: The peak resident memory of the process since it started, in bytes. None if not available
+    """
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, in kilobytes on Linux
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class StageTracer(object):
+    """
+    Record the metrics of each stage of the pipeline. Can be shared by several threads.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, algo=None, audio_duration=None):
+        """
+        Measure the code run in this context as one stage. The yielded record is a dict, where the code can set
+        audio_duration and output_length once known.
+
+        :param name: Name of the stage, like "decode", "extract", "clean" or "fgpt"
+        :param algo: The algo of the stage, if any, like "chords_chordino"
+        :param audio_duration: Duration of the audio processed by the stage, in seconds, if already known
+        """
+        record = {"stage": name, "algo": algo, "audio_duration": audio_duration, "output_length": None}
+        rss_start = peak_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_time"] = time.perf_counter() - wall_start
+            record["cpu_time"] = time.process_time() - cpu_start
+            record["process_peak_rss"] = peak_rss()
+            record["peak_rss_increase"] = None if rss_start is None else max(0, record["process_peak_rss"] - rss_start)
+            with self._lock:
+                self.records.append(record)
+
+    def summary(self):
+        """
+        Aggregate the records by stage and algo.
+
+        :return: A list of dict, one per stage and algo, with the number of calls, the total wall, cpu and audio
+          durations, the total output length, the largest peak_rss_increase and process_peak_rss of the calls, and the
+          real time factor (wall time / audio duration, of the calls where the audio duration is known)
+        """
+        with self._lock:
+            records = list(self.records)
+
+        summaries = {}
+        for record in records:
+            summary = summaries.setdefault((record["stage"], record["algo"]), {
+                "stage": record["stage"], "algo": record["algo"], "calls": 0, "wall_time": 0., "cpu_time": 0.,
+                "audio_duration": 0., "output_length": 0, "peak_rss_increase": None, "process_peak_rss": None,
+                "_timed_audio": 0.
+            })
+            summary["calls"] += 1
+            summary["wall_time"] += record["wall_time"]
+            summary["cpu_time"] += record["cpu_time"]
+            if record["audio_duration"]:
+                summary["audio_duration"] += record["audio_duration"]
+                summary["_timed_audio"] += record["wall_time"]
+            if record["output_length"] is not None:
+                summary["output_length"] += record["output_length"]
+            for field in ["peak_rss_increase", "process_peak_rss"]:
+                if record[field] is not None:
+                    summary[field] = max(summary[field] or 0, record[field])
+
+        for summary in summaries.values():
+            timed_audio = summary.pop("_timed_audio")
+            summary["real_time_factor"] = timed_audio / summary["audio_duration"] if summary["audio_duration"] else None
+
+        return list(summaries.values())
+
+    def to_json(self):
+        """
+        :return: A dict with all records, and their summary. Can be given to json.dump
+        """
+        with self._lock:
+            records = list(self.records)
+
+        return {"records": records, "summary": self.summary()}
+
+    def to_prometheus(self, prefix="claraprint"):
+        """
+        Export the summary in the Prometheus text format. Durations are in seconds, memory in bytes.
+
+        :param prefix: Prefix of the name of the metrics
+        :return: The metrics as a string
+        """
+        metrics = [
+            ("stage_calls_total", "counter", "Number of calls of the stage", "calls"),
+            ("stage_wall_seconds_total", "counter", "Wall time spent in the stage", "wall_time"),
+            ("stage_cpu_seconds_total", "counter", "CPU time spent in the stage", "cpu_time"),
+            ("stage_audio_seconds_total", "counter", "Duration of the audio processed by the stage", "audio_duration"),
+            ("stage_output_length_total", "counter", "Number of values output by the stage", "output_length"),
+            ("stage_peak_rss_increase_bytes", "gauge", "Increase of the peak resident memory of the process during the "
+                                                       "stage", "peak_rss_increase"),
+            ("stage_process_peak_rss_bytes", "gauge", "Peak resident memory of the process since it started, at the end "
+                                                      "of the stage", "process_peak_rss"),
+            ("stage_real_time_factor", "gauge", "Wall time divided by audio duration", "real_time_factor"),
+        ]
+        summaries = self.summary()
+
+        lines = []
+        for name, metric_type, help_text, field in metrics:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            for summary in summaries:
+                if summary[field] is None:
+                    continue
+                labels = f'stage="{summary["stage"]}",algo="{summary["algo"] or ""}"'
+                lines.append(f"{prefix}_{name}{{{labels}}} {summary[field]}")
+
+        return "\n".join(lines) + "\n"
+
+
+def trace(tracer, name, algo=None, audio_duration=None):
+    """
+    Same as tracer.stage, doing nothing if tracer is None. The yielded record can always be written to.
+
+    :param tracer: A StageTracer, or None
+    """
+    if tracer is None:
+        return nullcontext({})
+
+    return tracer.stage(name, algo, audio_duration)
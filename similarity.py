@@ -0,0 +1,110 @@
+"""
+Compute the similarity of all pairs of fingerprints, with any distance of utils.py (distance_levenshtein,
+distance_commonwords, distance_commonwords_ponderation).
+
+The matrix is cut into square tiles computed in parallel by a pool of processes. Each process receives the
+fingerprints once, when it starts, and then only tile coordinates. Tiles can be consumed one by one
+(similarity_tiles), or written into a matrix (similarity_matrix). The matrix can be a numpy.memmap, so the
+similarity of a whole catalogue does not need to fit in memory.
+"""
+
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from utils import distance_levenshtein, distance_commonwords, distance_commonwords_ponderation, ShingledFingerprint
+
+# Distances working on words. Fingerprints are split into words once (ShingledFingerprint), not once per pair
+words_distances = [distance_commonwords, distance_commonwords_ponderation]
+
+# Set in each worker process by _init_worker
+_rows = None
+_columns = None
+_distance = None
+
+
+def _prepare(fingerprints, distance):
+    if distance in words_distances:
+        return [ShingledFingerprint(fingerprint) for fingerprint in fingerprints]
+
+    return list(fingerprints)
+
+
+def _init_worker(rows, columns, distance):
+    global _rows, _columns, _distance
+    _rows = _prepare(rows, distance)
+    _columns = _rows if columns is None else _prepare(columns, distance)
+    _distance = distance
+
+
+def _compute_tile(tile):
+    """
+    :param tile: A tuple (first row, last row excluded, first column, last column excluded)
+    :return: A tuple (first row, first column, similarities of the tile as a 2D numpy array)
+    """
+    i0, i1, j0, j1 = tile
+    block = np.empty((i1 - i0, j1 - j0), dtype=np.float64)
+    for i in range(i0, i1):
+        for j in range(j0, j1):
+            block[i - i0, j - j0] = _distance(_rows[i], _columns[j])
+
+    return i0, j0, block
+
+
+def similarity_tiles(fingerprints, distance=distance_levenshtein, fingerprints_2=None, workers=None, tile_size=64):
+    """
+    Compute the similarity of all pairs of fingerprints, tile by tile.
+
+    :param fingerprints: A list of fingerprints (str)
+    :param distance: A function of utils.py, like distance_levenshtein. Must be defined at module level, so that it
+      can be sent to the worker processes
+    :param fingerprints_2: Optional. If given, compare each fingerprint of fingerprints to each of fingerprints_2. If
+      not, compare fingerprints to themselves. As distances are symmetric, only the tiles on and above the diagonal
+      are computed in this case
+    :param workers: Number of processes. Default is the number of CPUs. With 1, everything runs in this process
+    :param tile_size: Number of rows and columns of a tile
+    :return: A generator of (first row, first column, similarities of the tile as a 2D numpy array), in no
+      particular order
+    """
+    num_rows = len(fingerprints)
+    num_columns = num_rows if fingerprints_2 is None else len(fingerprints_2)
+
+    tiles = []
+    for i0 in range(0, num_rows, tile_size):
+        first_j0 = i0 if fingerprints_2 is None else 0
+        for j0 in range(first_j0, num_columns, tile_size):
+            tiles.append((i0, min(i0 + tile_size, num_rows), j0, min(j0 + tile_size, num_columns)))
+
+    if workers == 1:
+        _init_worker(fingerprints, fingerprints_2, distance)
+        for tile in tiles:
+            yield _compute_tile(tile)
+        return
+
+    with Pool(processes=workers or cpu_count(), initializer=_init_worker,
+              initargs=(fingerprints, fingerprints_2, distance)) as pool:
+        for result in pool.imap_unordered(_compute_tile, tiles):
+            yield result
+
+
+def similarity_matrix(fingerprints, distance=distance_levenshtein, fingerprints_2=None, workers=None, tile_size=64,
+                      out=None):
+    """
+    Compute the similarity of all pairs of fingerprints, as a matrix. See similarity_tiles for the parameters.
+
+    :param out: Optional matrix to write the similarities into, of shape (len(fingerprints), len(fingerprints_2)).
+      Use a numpy.memmap for a matrix too big to fit in memory. By default, a new float64 matrix is created
+    :return: The matrix. Cell (i, j) is the similarity of fingerprints[i] and fingerprints_2[j] (or fingerprints[j])
+    """
+    num_rows = len(fingerprints)
+    num_columns = num_rows if fingerprints_2 is None else len(fingerprints_2)
+    if out is None:
+        out = np.zeros((num_rows, num_columns), dtype=np.float64)
+
+    for i0, j0, block in similarity_tiles(fingerprints, distance, fingerprints_2, workers, tile_size):
+        out[i0:i0 + block.shape[0], j0:j0 + block.shape[1]] = block
+        if fingerprints_2 is None and i0 != j0:
+            # Tile below the diagonal, by symmetry
+            out[j0:j0 + block.shape[1], i0:i0 + block.shape[0]] = block.T
+
+    return out
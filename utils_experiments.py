@@ -6,6 +6,12 @@ from fingerprint import fgpt, clean_chords, clean_melody
 import config
 import random
 from utils import fingerprints_to_words
+from dataset_store import DatasetStore, ClaraprintMapping, iter_claraprints
+
+dataset_folder = os.path.dirname(os.path.realpath(__file__)) + "/dataset/"
+# Built with: python -m dataset_store dataset/dataset_rdb_100.jams.json.gz dataset/dataset_rdb_100.store
+dataset_store_path = dataset_folder + "dataset_rdb_100.store"
+_dataset_store = None  # Opened once, by get_dataset_store
 
 
 def get_full_piece_id(piece):
@@ -26,23 +32,41 @@ def get_full_piece_id(piece):
     return piece_id
 
 
+def get_dataset_store():
+    """
+    :return: The DatasetStore of the dataset, or None if it has not been built
+    """
+    global _dataset_store
+    if _dataset_store is None and exists(join(dataset_store_path, "meta.json")):
+        _dataset_store = DatasetStore(dataset_store_path)
+
+    return _dataset_store
+
+
 def get_all_fingerprints(duration, algo):
     """
     Get fingerprints as stored in the dataset. Will not recompute them contrary to compute_all_fingerprints
+    If the dataset store has been built (see dataset_store.py), claraprints are read from it when accessed. Otherwise,
+    the JSON dataset (unzipped or not) is read piece by piece.
 
     :param duration:
     :param algo:
     :return:
     """
-
-    dataset = json.load(open(os.path.dirname(os.path.realpath(__file__)) + "/dataset/dataset_rdb_100.jams.json", "r"))
+    store = get_dataset_store()
+    if store is not None:
+        keys = [str(duration) + "s_" + store.full_piece_id(row) + "_" + str(store.ytb_ids[row]) for row in range(len(store))]
+        return ClaraprintMapping(store, f"{duration}s_{algo}", keys)
+
+    dataset_path = dataset_folder + "dataset_rdb_100.jams.json"
+    if not exists(dataset_path):
+        # Read the downloaded file directly, without unzipping it
+        dataset_path += ".gz"
     fingerprints = {}  # Indexed by duration + "s" + "_" + full piece id
 
-    for piece in dataset:
-        for recording in piece["sandbox"]["recordings"]:
-            ytb_id = recording["url"].split("?v=")[-1]
-            key = str(duration) + "s_" + get_full_piece_id(piece["sandbox"]) + "_" + ytb_id
-            fingerprints[key] = recording["claraprints"][f"{duration}s_{algo}"]
+    for piece_id, ytb_id, _algo, claraprint in iter_claraprints(dataset_path, algos=[f"{duration}s_{algo}"]):
+        key = str(duration) + "s_" + piece_id + "_" + ytb_id
+        fingerprints[key] = claraprint
 
     return fingerprints
 
@@ -147,8 +171,15 @@ def get_all_fingerprints_by_rdb_id_multiple(duration, algos, all_fingerprints=No
     :param letters_set:
     :return:
     """
+    store = get_dataset_store()
+    if store is not None:
+        all_fgpt = {}
+        for row in range(len(store)):
+            all_fgpt.setdefault(str(store.rdb_ids[row]), []).append(store.recording(row))
+
+        return all_fgpt
 
-    dataset = json.load(open(os.path.dirname(os.path.realpath(__file__)) + "/dataset/dataset_rdb_100.json", "r"))
+    dataset = json.load(open(dataset_folder + "dataset_rdb_100.json", "r"))
 
     all_fgpt = {}
     for piece in dataset:
@@ -200,7 +231,7 @@ def fingerprint_from_n_sources_multiple_algos(fgpts, num_sources, range_words, c
     return final_fgpt, used_ytb_ids
 
 
-def fingerprint_from_one_random(fgpts, num_sources, range_words):
+def fingerprint_from_one_random(fgpts, num_sources, range_words, combination_mode=None):
     sample = random.randint(0, len(fgpts) - 1)
     fgpt = fgpts[sample]["fgpt"]
     ytb_id = fgpts[sample]["path"].split("/")[-1].split("_", 2)[-1].split(".")[0]
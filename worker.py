@@ -0,0 +1,190 @@
+"""
+Long-lived fingerprinting worker. Libraries (librosa, vamp plugins, crema and its model) are loaded and warmed up once,
+when the worker starts, instead of at the first claraprint of each short-lived process.
+
+Requests and responses are JSON lines. A request gives one or several audio files, and optionally the algos to compute
+(default: all), "offset" and "duration" to only fingerprint a window of each file, in seconds (default: the whole
+file), and "profile" to get the time spent in each stage (see profiling.py):
+
+    {"id": 1, "audio_paths": ["/data/audio/a.mp3", "/data/audio/b.mp3"], "algos": ["chords_chordino"], "profile": true}
+
+The audio files of a request are fingerprinted together, crema running on batches of files (see
+fingerprint.claraprints_many). The response has the same id, and one result per audio file, in order, like the lines
+written by batch.py:
+
+    {"id": 1, "results": [{"audio_path": "/data/audio/a.mp3", "claraprints": {"chords_chordino": "hjkhab..."}},
+                          {"audio_path": "/data/audio/b.mp3", "error": "OSError: Audio file ... not found"}],
+     "profile": [...]}
+
+The worker reads requests on stdin and writes responses on stdout, or listens on a TCP port (one JSON line request,
+one JSON line response, as many as wanted per connection). Requests are served one at a time.
+
+Usage:
+
+    python -m worker
+    python -m worker --port 5454 --cache-dir /data/claraprint_cache
+"""
+
+import argparse
+import json
+import socketserver
+import sys
+import time
+
+import numpy as np
+
+from cache import ExtractionCache
+from fingerprint import all_algos, claraprints_many, extract_pitches
+from profiling import StageTracer
+
+
+def warm_up(algos=all_algos, duration=5., sr=44100):
+    """
+    Load the libraries and models of the algos, and run each algo once on a short synthetic buffer, so that the first
+    request does not pay for it.
+
+    :param algos: The algos to warm up
+    :param duration: Duration of the synthetic buffer, in seconds
+    :param sr: Sample rate of the synthetic buffer
+    :return: A dict algo -> seconds spent warming it up
+    """
+    # A A major chord
+    t = np.arange(int(duration * sr)) / sr
+    y = (sum(np.sin(2 * np.pi * f * t) for f in [220., 277.18, 329.63]) / 3).astype(np.float32)
+
+    durations = {}
+    for algo in algos:
+        t1 = time.time()
+        if algo == "chords_crema":
+            # Requests go through claraprints_many, which runs crema by batches
+            from extract_information import extract_chords_crema_many
+            extract_chords_crema_many(ys=[y], sr=sr)
+        else:
+            extract_pitches(algo, y=y, sr=sr)
+        durations[algo] = time.time() - t1
+
+    return durations
+
+
+def handle_request(request, cache=None, batch_size=8):
+    """
+    Compute the claraprints asked by one request. Never raises: an invalid request, or an audio file in error, is
+    reported in the response.
+
+    :param request: A dict, see the description of this module
+    :param cache: An optional cache.ExtractionCache
+    :param batch_size: Number of files of the request run through the crema model at once
+    :return: The response, as a dict
+    """
+    response = {"id": request.get("id")} if isinstance(request, dict) else {"id": None}
+    try:
+        audio_paths = request.get("audio_paths") or [request["audio_path"]]
+        if not isinstance(audio_paths, list) or not all(isinstance(audio_path, str) for audio_path in audio_paths):
+            raise IOError("audio_paths must be a list of paths")
+        algos = request.get("algos") or all_algos
+        if not isinstance(algos, list):
+            raise IOError("algos must be a list of algos")
+        offset = float(request.get("offset") or 0.)
+        duration = None if request.get("duration") is None else float(request["duration"])
+        for algo in algos:
+            if algo not in all_algos:
+                raise IOError(f"Algo {algo} not supported")
+    except Exception as e:
+        response["error"] = f"Invalid request: {type(e).__name__}: {e}"
+        return response
+
+    tracer = StageTracer() if request.get("profile") else None
+    # All files at once, so that crema runs on batches of files. A file in error does not stop the others
+    claraprints_list = claraprints_many(audio_paths, algos, cache=cache, offset=offset, duration=duration,
+                                        batch_size=batch_size, return_errors=True, tracer=tracer)
+    response["results"] = [_result(audio_path, claraprints_)
+                           for audio_path, claraprints_ in zip(audio_paths, claraprints_list)]
+
+    if tracer is not None:
+        response["profile"] = tracer.summary()
+
+    return response
+
+
+def _result(audio_path, claraprints_):
+    """
+    :param claraprints_: The claraprints of the file, or the exception raised while computing them
+    :return: The result of one file, like the lines written by batch.py
+    """
+    if isinstance(claraprints_, Exception):
+        return {"audio_path": audio_path, "error": f"{type(claraprints_).__name__}: {claraprints_}"}
+
+    return {"audio_path": audio_path, "claraprints": claraprints_}
+
+
+def handle_line(line, cache=None):
+    """
+    :param line: A JSON line request
+    :param cache: An optional cache.ExtractionCache
+    :return: The JSON line response, with the ending new line
+    """
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        return json.dumps({"id": None, "error": f"Invalid request: {e}"}) + "\n"
+
+    return json.dumps(handle_request(request, cache)) + "\n"
+
+
+def serve_stdin(cache=None):
+    """
+    Serve the requests read on stdin, one per line, until stdin is closed. Responses are written on stdout.
+    """
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        sys.stdout.write(handle_line(line, cache))
+        sys.stdout.flush()
+
+
+class FingerprintHandler(socketserver.StreamRequestHandler):
+    """
+    Serve the JSON line requests of one TCP connection, until the client closes it.
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            self.wfile.write(handle_line(line.decode("utf-8"), self.server.cache).encode("utf-8"))
+            self.wfile.flush()
+
+
+def serve_tcp(host, port, cache=None):
+    """
+    Serve the requests received on the given TCP port, one connection at a time, until interrupted.
+    """
+    socketserver.TCPServer.allow_reuse_address = True
+    with socketserver.TCPServer((host, port), FingerprintHandler) as server:
+        server.cache = cache
+        server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve claraprint requests from a warm process")
+    parser.add_argument("--algos", nargs="+", default=all_algos, choices=all_algos, help="Algos to warm up")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on, with --port")
+    parser.add_argument("--port", type=int, default=None, help="TCP port to listen on (default: serve stdin)")
+    parser.add_argument("--cache-dir", default=None, help="Directory of the extractors cache (default: no cache)")
+    parser.add_argument("--cache-size", type=int, default=10 * 1024 ** 3, help="Maximum size of the cache in bytes")
+    args = parser.parse_args()
+
+    cache = ExtractionCache(args.cache_dir, max_size=args.cache_size) if args.cache_dir else None
+
+    # stdout is kept for the responses
+    durations = warm_up(args.algos)
+    print("warm " + ",".join(f"{algo}={duration:.2f}s" for algo, duration in durations.items()), file=sys.stderr)
+
+    if args.port is None:
+        serve_stdin(cache)
+    else:
+        serve_tcp(args.host, args.port, cache)
+
+
+if __name__ == "__main__":
+    main()